@@ -2,6 +2,7 @@ import logging
 
 import typer
 
+from .benchmark import app as benchmark_app
 from .elastic import app as elastic_app
 from .profile_tester import app as profile_app
 from .ml import app as ml_app
@@ -19,6 +20,7 @@ app.add_typer(ml_app, name="ml", no_args_is_help=True)
 app.add_typer(scrape_app, name="scrape", no_args_is_help=True)
 app.add_typer(couch_app, name="couch", no_args_is_help=True)
 app.add_typer(fake_app, name="fakes", no_args_is_help=True)
+app.add_typer(benchmark_app, name="benchmark", no_args_is_help=True)
 
 
 if __name__ == "__main__":
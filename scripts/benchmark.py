@@ -0,0 +1,389 @@
+import logging
+import os
+import re
+import time
+from typing import Callable, Iterable, TypeVar
+
+import typer
+from rich.console import Console
+from rich.table import Table
+
+from bs4 import FeatureNotFound
+from modules.elastic import ArticleSearchQuery
+from modules.misc import create_folder
+from modules.objects import FullArticle, TagsOfInterest
+from modules.profiles import Profile, get_profile, get_profiles
+from scripts import config_options
+from scripts.scraping.articles import gather_profiles_urls
+from scripts.scraping.articles.dedup import article_id
+from scripts.scraping.articles.drivers import DriverPool
+from scripts.scraping.articles.dates import DateParser, load_dateparser
+from scripts.scraping.articles.extract import (
+    LinkedDataIndex,
+    extract_article_content,
+    extract_meta_information,
+)
+from scripts.scraping.articles.fetching import fetch_article_page
+from scripts.scraping.articles.parsing import parse_html, parser_backends
+from scripts.scraping.articles.selector_plans import meta_plan
+from scripts.scraping.articles.text import (
+    external_identifiers,
+    generate_tags,
+    internal_identifiers,
+    locate_objects_of_interest,
+    tokenize_text,
+)
+
+app = typer.Typer()
+console = Console()
+
+logger = logging.getLogger("osinter")
+
+T = TypeVar("T")
+Input = TypeVar("Input")
+
+
+def download_sample(sample_size: int) -> list[FullArticle]:
+    logger.info(f"Downloading {sample_size} articles for benchmarking")
+    return config_options.es_article_client.query_documents(
+        ArticleSearchQuery(
+            limit=sample_size, sort_by="publish_date", sort_order="desc"
+        ),
+        True,
+    )[0]
+
+
+# Returns the average time in milliseconds for running the function over all the inputs, along with the results
+def time_per_item(
+    function: Callable[[Input], T], inputs: list[Input], rounds: int
+) -> tuple[float, list[T]]:
+    results: list[T] = []
+    best = float("inf")
+
+    for _ in range(rounds):
+        start = time.perf_counter()
+        results = [function(item) for item in inputs]
+        best = min(best, time.perf_counter() - start)
+
+    return best / max(len(inputs), 1) * 1000, results
+
+
+# The tokenizer as it was before being tuned, kept for comparing both speed and output
+def reference_tokenize_text(clean_clear_text: str) -> list[str]:
+    clean_clear_text = re.sub(r"(?:\'|’)\S*", "", clean_clear_text)
+    clean_clear_text = re.sub(
+        r'\s(?:,|\.|"|\'|\/|\\|:|-)+|(?:,|\.|"|\'|\/|\\|:|-)+\s', " ", clean_clear_text
+    )
+    clean_clear_text = re.sub(r"(?:\{.*\})", "", clean_clear_text)
+    clean_clear_text = re.sub(r"“|\"|\(|\)", " ", clean_clear_text)
+    clean_clear_text = re.sub(r"\s[^a-zA-Z]*\s", " ", clean_clear_text)
+
+    return clean_clear_text.lower().split(" ")
+
+
+# Runs every extractor on every article, like it was done before the candidate patterns were introduced
+def reference_locate_objects_of_interest(clear_text: str) -> list[TagsOfInterest]:
+    results: list[TagsOfInterest] = []
+
+    for object_name, pattern in internal_identifiers.items():
+        result = [value.upper() for value in pattern.findall(clear_text)]
+
+        if result:
+            results.append(TagsOfInterest(name=object_name, values=list(set(result))))
+
+    for object_name, (_, identifier) in external_identifiers.items():
+        result = list(set(identifier(clear_text)))
+
+        if result:
+            results.append(TagsOfInterest(name=object_name, values=result))
+
+    return results
+
+
+# Values are compared as sets, as their order depends on set iteration
+def same_objects_of_interest(
+    before: list[TagsOfInterest], after: list[TagsOfInterest]
+) -> bool:
+    return [(tag.name, set(tag.values)) for tag in before] == [
+        (tag.name, set(tag.values)) for tag in after
+    ]
+
+
+def print_comparison(
+    title: str, rows: Iterable[tuple[str, float, float]], identical: int, total: int
+) -> None:
+    table = Table(
+        "Stage", "Before (ms/article)", "After (ms/article)", "Speedup", title=title
+    )
+
+    for stage, before, after in rows:
+        table.add_row(stage, f"{before:.3f}", f"{after:.3f}", f"{before / after:.2f}x")
+
+    console.print(table)
+    console.print(f"Identical output for {identical} out of {total} articles")
+
+
+@app.command()
+def tokenizer(sample_size: int = 1000, rounds: int = 5) -> None:
+    contents = [article.content for article in download_sample(sample_size)]
+
+    tokenizing_before, _ = time_per_item(reference_tokenize_text, contents, rounds)
+    tokenizing_after, _ = time_per_item(
+        lambda content: list(tokenize_text(content)), contents, rounds
+    )
+
+    # Tag generation is the part shared by live scraping and "elastic migrate regenerate-tags"
+    tagging_before, tags_before = time_per_item(
+        lambda content: generate_tags(reference_tokenize_text(content)),
+        contents,
+        rounds,
+    )
+    tagging_after, tags_after = time_per_item(
+        lambda content: generate_tags(tokenize_text(content)), contents, rounds
+    )
+
+    print_comparison(
+        "Tokenizer",
+        [
+            ("Tokenizing", tokenizing_before, tokenizing_after),
+            ("Tokenizing and generating tags", tagging_before, tagging_after),
+        ],
+        sum(1 for before, after in zip(tags_before, tags_after) if before == after),
+        len(contents),
+    )
+
+
+@app.command()
+def iocs(sample_size: int = 1000, rounds: int = 3) -> None:
+    contents = [article.content for article in download_sample(sample_size)]
+
+    before, results_before = time_per_item(
+        reference_locate_objects_of_interest, contents, rounds
+    )
+    after, results_after = time_per_item(locate_objects_of_interest, contents, rounds)
+
+    print_comparison(
+        "IOC extraction",
+        [("Locating objects of interest", before, after)],
+        sum(
+            1
+            for result_before, result_after in zip(results_before, results_after)
+            if same_objects_of_interest(result_before, result_after)
+        ),
+        len(contents),
+    )
+
+
+# Saved article pages, stored as <profile name>/<article id>.html
+html_fixtures_path = "./cache/html_fixtures"
+
+
+def load_html_fixtures(fixtures_path: str) -> list[tuple[Profile, bytes]]:
+    fixtures: list[tuple[Profile, bytes]] = []
+
+    for profile_name in sorted(os.listdir(fixtures_path)):
+        profile = get_profile(profile_name)
+        profile_path = os.path.join(fixtures_path, profile_name)
+
+        for file_name in sorted(os.listdir(profile_path)):
+            with open(os.path.join(profile_path, file_name), "rb") as f:
+                fixtures.append((profile, f.read()))
+
+    return fixtures
+
+
+# Returns the time spent parsing and running the profile selectors, along with what was extracted. Whitespace in the
+# text is normalized, as parsers differ slightly in the whitespace they keep around tags
+def extract_fixture(
+    profile: Profile, source: bytes, backend: str
+) -> tuple[float, float, tuple[str | None, ...] | None]:
+    start = time.perf_counter()
+    soup = parse_html(source, backend)
+    parsed = time.perf_counter()
+
+    try:
+        meta = extract_meta_information(
+            soup, profile.scraping.meta, profile.source.address
+        )
+        _, clear_text = extract_article_content(profile.scraping.content, soup)
+        extracted: tuple[str | None, ...] | None = (
+            meta.title,
+            meta.description,
+            meta.author,
+            meta.image_url,
+            " ".join(clear_text.split()),
+        )
+    except Exception:
+        extracted = None
+
+    return parsed - start, time.perf_counter() - parsed, extracted
+
+
+@app.command()
+def save_pages(
+    articles_per_profile: int = 5, destination: str = html_fixtures_path
+) -> None:
+    profiles = get_profiles()
+
+    with DriverPool() as driver_pool:
+        url_collection = gather_profiles_urls(
+            profiles, articles_per_profile, driver_pool=driver_pool
+        )
+
+        for profile in profiles:
+            profile_name = profile.source.profile_name
+            create_folder(os.path.join(destination, profile_name), change_mode=False)
+
+            for url in url_collection[profile_name][:articles_per_profile]:
+                try:
+                    page = fetch_article_page(url, profile, driver_pool=driver_pool)
+                except Exception:
+                    logger.exception(f'Failed fetching "{url}", skipping it')
+                    continue
+
+                source = (
+                    page.source.encode("utf-8")
+                    if isinstance(page.source, str)
+                    else page.source
+                )
+
+                with open(
+                    os.path.join(destination, profile_name, f"{article_id(url)}.html"),
+                    "wb",
+                ) as f:
+                    f.write(source)
+
+    logger.info(f'Saved article pages to "{destination}"')
+
+
+# Compares the parser backends on saved article pages, both in speed and in whether the articles come out the same as
+# with the pure Python parser
+@app.command()
+def parsers(fixtures_path: str = html_fixtures_path, rounds: int = 3) -> None:
+    fixtures = load_html_fixtures(fixtures_path)
+
+    if not fixtures:
+        logger.error(
+            f'No saved pages found in "{fixtures_path}", save some with "benchmark save-pages" first'
+        )
+        raise typer.Exit(1)
+
+    table = Table(
+        "Backend",
+        "Parse (ms/article)",
+        "Selectors (ms/article)",
+        "Total (ms/article)",
+        "Identical to html.parser",
+        title=f"HTML parsers over {len(fixtures)} saved pages",
+    )
+
+    reference = [
+        extract_fixture(profile, source, "html.parser")[2]
+        for profile, source in fixtures
+    ]
+
+    for backend in parser_backends:
+        try:
+            parse_html("", backend)
+        except FeatureNotFound:
+            logger.warning(f'HTML parser "{backend}" isn\'t installed, skipping it')
+            continue
+
+        parse_time = selector_time = float("inf")
+        results: list[tuple[str | None, ...] | None] = []
+
+        # The extraction changes the tree, so every round starts from a fresh parse
+        for _ in range(rounds):
+            timings = [
+                extract_fixture(profile, source, backend)
+                for profile, source in fixtures
+            ]
+
+            parse_time = min(parse_time, sum(timing[0] for timing in timings))
+            selector_time = min(selector_time, sum(timing[1] for timing in timings))
+            results = [timing[2] for timing in timings]
+
+        identical = sum(
+            1
+            for before, after in zip(reference, results)
+            if before is not None and before == after
+        )
+
+        table.add_row(
+            backend,
+            f"{parse_time / len(fixtures) * 1000:.3f}",
+            f"{selector_time / len(fixtures) * 1000:.3f}",
+            f"{(parse_time + selector_time) / len(fixtures) * 1000:.3f}",
+            f"{identical}/{sum(1 for result in reference if result is not None)}",
+        )
+
+    console.print(table)
+
+    for (profile, _), result in zip(fixtures, reference):
+        if result is None:
+            logger.warning(
+                f'A saved page from the "{profile.source.profile_name}" profile couldn\'t be extracted with html.parser'
+            )
+
+
+# The publish date strings of the saved pages, found the same way as when scraping them
+def load_raw_publish_dates(fixtures_path: str) -> list[tuple[str, str]]:
+    raw_dates: list[tuple[str, str]] = []
+
+    for profile, source in load_html_fixtures(fixtures_path):
+        soup = parse_html(source)
+        selector = meta_plan(profile.scraping.meta).publish_date
+        raw_date = (
+            selector.extract(soup) if selector else None
+        ) or LinkedDataIndex.from_soup(soup).first_string("datePublished")
+
+        if raw_date:
+            raw_dates.append((profile.source.profile_name, raw_date))
+
+    return raw_dates
+
+
+@app.command()
+def dates(fixtures_path: str = html_fixtures_path, rounds: int = 3) -> None:
+    raw_dates = load_raw_publish_dates(fixtures_path)
+
+    if not raw_dates:
+        logger.error(
+            f'No publish dates found in the saved pages in "{fixtures_path}", save some with "benchmark save-pages" first'
+        )
+        raise typer.Exit(1)
+
+    date_parse = load_dateparser()
+    date_parser = DateParser()
+
+    # The hit rates are taken from a first pass, where formats are learned along the way like during a scrape run
+    for profile_name, raw_date in raw_dates:
+        date_parser.parse(raw_date, profile_name)
+
+    hits = date_parser.hits.copy()
+
+    before, results_before = time_per_item(
+        lambda item: date_parse(item[1]), raw_dates, rounds
+    )
+    after, results_after = time_per_item(
+        lambda item: date_parser.parse(item[1], item[0]), raw_dates, rounds
+    )
+
+    print_comparison(
+        "Date parsing",
+        [("Parsing publish dates", before, after)],
+        sum(
+            1
+            for result_before, result_after in zip(results_before, results_after)
+            if result_before == result_after
+        ),
+        len(raw_dates),
+    )
+
+    table = Table("Parsed with", "Dates", "Share", title="Date parsing hit rates")
+    total_hits = sum(hits.values())
+
+    for method, method_hits in hits.most_common():
+        table.add_row(method, str(method_hits), f"{method_hits / total_hits:.1%}")
+
+    console.print(table)
@@ -1,35 +1,145 @@
-import json
-import gzip
+from collections.abc import Iterator
 from datetime import datetime
+import itertools
+import json
 import logging
+import os
 from typing import Any
 from scripts import config_options
 import typer
 from couchdb import Database, Server
+from modules.misc import create_folder
+
+from ..ndjson import (
+    open_text,
+    read_documents,
+    verify_checksum,
+    write_checksum,
+    write_lines,
+)
 
 app = typer.Typer(no_args_is_help=True)
 logger = logging.getLogger("osinter")
 
 current_day = datetime.today().strftime("%Y-%m-%d-%H:%M:%S")
 
+# The update sequence the last backup covers, which incremental backups continue from
+backup_state_path = "./cache/couch_backup.json"
+
 
 def getDB() -> Database:
     return Server(config_options.COUCHDB_URL)[config_options.COUCHDB_NAME]
 
 
+def load_last_seq() -> str | None:
+    if not os.path.exists(backup_state_path):
+        return None
+
+    with open(backup_state_path, "r") as f:
+        last_seq: str = json.load(f)["last_seq"]
+
+    return last_seq
+
+
+def save_last_seq(last_seq: str) -> None:
+    create_folder(os.path.dirname(backup_state_path), change_mode=False)
+
+    with open(backup_state_path, "w") as f:
+        json.dump({"last_seq": last_seq}, f)
+
+
+# Reads every document a page at a time through _all_docs, instead of requesting each document on its own
+def iterate_all_docs(db: Database, batch_size: int) -> Iterator[dict[str, Any]]:
+    for row in db.iterview("_all_docs", batch_size, include_docs=True):
+        yield dict(row.doc)
+
+
 @app.command()
 def backup(
-    backup_path: str = "./", backup_file_name: str = f"couch-backup-{current_day}.gz"
+    backup_path: str = "./",
+    backup_file_name: str = f"couch-backup-{current_day}.ndjson.gz",
+    batch_size: int = 1000,
+    incremental: bool = False,
 ) -> None:
     db = getDB()
     backup_full_path = backup_path + backup_file_name
 
-    docs: list[dict[str, Any]] = []
+    since = load_last_seq() if incremental else None
+
+    if incremental and since is None:
+        logger.warning("No previous backup found, making a full backup instead")
+
+    document_count = 0
+    last_seq: str
+
+    logger.debug(f'Writing documents to disk at "{backup_full_path}"')
+
+    with open_text(backup_full_path, "w") as f:
+        if since is None:
+            # Taken before reading, so anything changed while the backup runs is included in the next incremental one
+            last_seq = db.info()["update_seq"]
+            document_count = write_lines(f, iterate_all_docs(db, batch_size))
+        else:
+            logger.debug(f"Downloading documents changed since sequence {since}")
+
+            # Deleted documents are included as tombstones, so they are deleted again on restore
+            while True:
+                changes = db.changes(since=since, limit=batch_size, include_docs="true")
+                document_count += write_lines(
+                    f, (change["doc"] for change in changes["results"])
+                )
+                since = changes["last_seq"]
+
+                if len(changes["results"]) < batch_size:
+                    break
+
+            last_seq = since
+
+    write_checksum(backup_full_path)
+    save_last_seq(last_seq)
+
+    logger.info(
+        f'Backed up {document_count} documents to "{backup_full_path}", up to sequence {last_seq}'
+    )
+
+
+@app.command()
+def restore(
+    backup_file: str, batch_size: int = 1000, skip_checksum: bool = False
+) -> None:
+    db = getDB()
+
+    if skip_checksum:
+        pass
+    elif not os.path.exists(f"{backup_file}.sha256"):
+        logger.warning(f'No checksum found for "{backup_file}", restoring anyway')
+    elif not verify_checksum(backup_file):
+        logger.error(f'Checksum for "{backup_file}" doesn\'t match, aborting restore')
+        raise typer.Exit(1)
+
+    restored_count = 0
+    failed_count = 0
+
+    # Older backups are a single JSON array, which can be read the same way as the newline delimited ones
+    with open_text(backup_file, "r") as f:
+        docs: Iterator[dict[str, Any]] = read_documents(f)
+
+        while batch := list(itertools.islice(docs, batch_size)):
+            # Without new edits, the revisions from the backup are kept instead of new ones being created. CouchDB
+            # only reports the documents which failed in this mode
+            batch_failures = 0
+
+            for success, doc_id, result in db.update(batch, new_edits=False):
+                if not success:
+                    batch_failures += 1
+                    logger.error(f'Failed restoring document "{doc_id}": {result}')
+
+            restored_count += len(batch) - batch_failures
+            failed_count += batch_failures
+
+            logger.debug(f"Restored {restored_count} documents")
 
-    logger.debug("Downloading documents")
-    for id in db:
-        docs.append(dict(db[id]))
+    logger.info(f"Restored {restored_count} documents")
 
-    logger.debug(f'Downloaded {len(docs)}, writing to disk at "{backup_full_path}"')
-    with gzip.open(backup_full_path, "wt", encoding="utf-8") as f:
-        json.dump(docs, f)
+    if failed_count:
+        logger.error(f"Failed restoring {failed_count} documents")
@@ -1,21 +1,40 @@
-import gzip
+from collections import Counter
+from collections.abc import Iterator
+from concurrent.futures import (
+    ALL_COMPLETED,
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from hashlib import md5
 import itertools
 import json
 import logging
 import os
+import time
 from typing import Any
 from datetime import datetime
 
+from elasticsearch import helpers
+from pydantic import ValidationError
 import typer
 
-from modules.elastic import (
-    ArticleSearchQuery,
-    return_article_db_conn,
-)
 from modules.files import article_to_md
+from modules.misc import create_folder
 from modules.objects import FullArticle
 
+from .utils import iterate_pit_hit_pages
 from .. import config_options
+from ..ndjson import (
+    open_text,
+    read_documents,
+    read_lines,
+    verify_checksum,
+    write_array,
+    write_checksum,
+    write_lines,
+)
 
 logger = logging.getLogger("osinter")
 
@@ -23,99 +42,250 @@ logger = logging.getLogger("osinter")
 app = typer.Typer()
 
 
+# Only fields of the article model are exported, leaving out those generated by the ingest pipeline, and articles are
+# passed through the model like they are when imported again. Exports limited to a few fields can't be validated when
+# those leave out fields the model requires, so those are written as stored
 @app.command()
-def articles_to_json(export_filename: str) -> None:
-    logger.debug("Downloading articles")
-    articles = config_options.es_article_client.query_all_documents()
+def articles_to_json(
+    export_filename: str,
+    field: list[str] = [],
+    exclude_field: list[str] = [],
+    ndjson: bool = False,
+    page_size: int = 1000,
+) -> None:
+    index_name = config_options.ELASTICSEARCH_ARTICLE_INDEX
 
-    logger.debug(
-        f"Downloaded {len(articles)} articles. Converting them to json objects"
-    )
+    source_fields = [
+        name
+        for name in FullArticle.model_fields
+        if name != "id" and (not field or name in field) and name not in exclude_field
+    ]
+    unknown_fields = set(field) - set(FullArticle.model_fields)
+    if unknown_fields:
+        logger.warning(
+            f'Ignoring fields {", ".join(sorted(unknown_fields))}, which aren\'t part of articles'
+        )
 
-    article_dicts = []
+    validate = all(
+        name in source_fields
+        for name, field_info in FullArticle.model_fields.items()
+        if name != "id" and field_info.is_required()
+    )
+    if not validate:
+        logger.info(
+            "Articles won't be validated, as the selected fields leave out some that are required"
+        )
 
-    for article in articles:
-        article_dicts.append(article.model_dump(mode="json"))
+    invalid_count = 0
 
-    logger.debug(f"Converted {len(article_dicts)} articles. Writing them to json file")
+    # The id isn't part of the source, so it's added to every article to keep the export importable
+    def articles() -> Iterator[dict[str, Any]]:
+        nonlocal invalid_count
 
-    with open(export_filename, "w") as export_file:
-        json.dump(article_dicts, export_file, default=str)
+        for hits in iterate_pit_hit_pages(
+            config_options.es_conn,
+            index_name,
+            page_size,
+            source_includes=source_fields,
+        ):
+            for hit in hits:
+                if not validate:
+                    yield {"id": hit["_id"], **hit["_source"]}
+                    continue
+
+                try:
+                    article = FullArticle.model_validate(hit["_source"])
+                except ValidationError:
+                    invalid_count += 1
+                    logger.exception(f'Skipping invalid article with id "{hit["_id"]}"')
+                    continue
+
+                article.id = hit["_id"]
+                yield article.model_dump(mode="json", include={"id", *source_fields})
+
+    logger.debug(f'Exporting articles from "{index_name}" to "{export_filename}"')
+
+    with open_text(export_filename, "w") as export_file:
+        if ndjson:
+            exported_count = write_lines(export_file, articles())
+        else:
+            exported_count = write_array(export_file, articles())
+
+    logger.info(
+        f'Exported {exported_count} articles to "{export_filename}", skipping {invalid_count} invalid ones'
+    )
 
 
 @app.command()
 def json_to_articles(
-    import_filename: str, bypass_ingest_pipeline: bool = False, use_bulk: bool = True
+    import_filename: str,
+    bypass_ingest_pipeline: bool = False,
+    use_bulk: bool = True,
+    batch_size: int = 500,
 ) -> None:
-    logger.debug("Loading articles from file")
+    logger.debug(f'Importing articles from "{import_filename}"')
 
-    with open(import_filename, "r") as import_file:
-        local_articles: list[dict[str, Any]] = json.load(import_file)
+    read_count = 0
+    saved_count = 0
+    invalid_count = 0
+    start_time = time.monotonic()
+
+    # The file is handled a batch at a time, so memory use only depends on the batch size and not the size of the file
+    with open_text(import_filename, "r") as import_file:
+        local_articles: Iterator[dict[str, Any]] = read_documents(import_file)
+
+        while batch := list(itertools.islice(local_articles, batch_size)):
+            read_count += len(batch)
+
+            remote_article_urls = config_options.es_article_client.exists_in_db(
+                [article["url"] for article in batch if "url" in article]
+            )
+
+            new_articles: list[FullArticle] = []
+
+            for article in batch:
+                if article.get("url") in remote_article_urls:
+                    continue
+
+                try:
+                    new_articles.append(FullArticle(**article))
+                except ValidationError:
+                    invalid_count += 1
+                    logger.exception(
+                        f'Skipping invalid article with URL "{article.get("url")}"'
+                    )
+
+            if use_bulk:
+                saved_count += config_options.es_article_client.save_documents(
+                    new_articles, not bypass_ingest_pipeline
+                )
+            else:
+                for new_article in new_articles:
+                    config_options.es_article_client.save_document(new_article)
+                    saved_count += 1
+
+            elapsed = time.monotonic() - start_time
+            logger.debug(
+                f"Read {read_count} articles and saved {saved_count} new ones, at {read_count / elapsed:.1f} articles per second"
+            )
+
+    logger.info(
+        f"Saved {saved_count} new articles out of {read_count} in {time.monotonic() - start_time:.1f} seconds, skipping {invalid_count} invalid ones"
+    )
 
-    logger.debug("Removing already present articles")
 
-    local_article_urls = [
-        article["url"] for article in local_articles if "url" in article
-    ]
-    remote_article_urls = config_options.es_article_client.exists_in_db(
-        local_article_urls
-    )
+def write_file_atomically(path: str, contents: str) -> None:
+    temporary_path = f"{path}.tmp"
 
-    new_articles: list[FullArticle] = []
+    with open(temporary_path, "w") as f:
+        f.write(contents)
 
-    for article in local_articles:
-        if article["url"] not in remote_article_urls:
-            current_article_object = FullArticle(**article)
-            new_articles.append(current_article_object)
+    os.replace(temporary_path, path)
 
-    logger.debug(f"Saving {len(new_articles)} new articles")
 
-    saved_count = 0
-    if use_bulk:
-        saved_count = config_options.es_article_client.save_documents(
-            new_articles, not bypass_ingest_pipeline
-        )
-    else:
-        for new_article in new_articles:
-            config_options.es_article_client.save_document(new_article)
-            saved_count += 1
+# Identifies the version of an article, so unchanged articles can be skipped. Embeddings aren't part of the
+# markdown, so they are left out to avoid rewriting articles just because they were embedded again
+def article_fingerprint(source: dict[str, Any]) -> str:
+    fingerprinted_fields = {
+        field: value for field, value in source.items() if field != "embeddings"
+    }
+    return md5(
+        json.dumps(fingerprinted_fields, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
 
-    logger.info(f"Saved {saved_count} new articles")
+# Runs in the worker processes, receiving the raw hit so only plain data is pickled between processes
+def render_article_md(hit: dict[str, Any], article_path: str) -> None:
+    article = FullArticle.model_validate(hit["_source"])
+    article.id = hit["_id"]
+
+    write_file_atomically(article_path, article_to_md(article))
 
 
 @app.command()
-def articles_to_md(destination: str) -> None:
+def articles_to_md(
+    destination: str, workers: int | None = None, page_size: int = 500
+) -> None:
     folder_path = os.path.join(destination, "MDArticles")
+    create_folder(folder_path, change_mode=False)
 
-    try:
-        os.mkdir(folder_path)
-    except FileExistsError:
-        pass
+    index_name = config_options.ELASTICSEARCH_ARTICLE_INDEX
+    worker_count = workers or os.cpu_count() or 1
 
     logger.info("Downloading list of profiles...")
     profiles = list(config_options.es_article_client.get_unique_values("profile"))
 
-    for profile in profiles:
-        logger.info(f"Downloading list of articles for {profile}")
+    written_count = 0
+    skipped_count = 0
+
+    with ProcessPoolExecutor(worker_count) as executor:
+        for profile in profiles:
+            profile_path = os.path.join(folder_path, profile)
+            create_folder(profile_path, change_mode=False)
+
+            # Fingerprints of the articles as they were when last written, stored along with the markdown files
+            manifest_path = os.path.join(profile_path, ".manifest.json")
+            manifest: dict[str, str] = {}
+
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r") as f:
+                    manifest = json.load(f)
 
-        articles = config_options.es_article_client.query_documents(
-            ArticleSearchQuery(limit=0, sources=set(profile)), True
-        )[0]
+            pending: dict[Future[None], tuple[str, str]] = {}
 
-        try:
-            os.mkdir(os.path.join(folder_path, profile))
-        except FileExistsError:
-            pass
+            def collect(return_when: str) -> None:
+                nonlocal written_count
 
-        logger.info(f"Converting {len(articles)} articles for {profile}")
+                done, _ = wait(pending, return_when=return_when)
 
-        for article in articles:
-            article_md = article_to_md(article)
+                for future in done:
+                    article_id, fingerprint = pending.pop(future)
 
-            with open(
-                os.path.join(folder_path, profile, f"{article.id}.md"), "w"
-            ) as article_file:
-                article_file.write(article_md)
+                    try:
+                        future.result()
+                    except Exception:
+                        logger.exception(
+                            f'Failed converting article with id "{article_id}" for {profile}'
+                        )
+                        continue
+
+                    manifest[article_id] = fingerprint
+                    written_count += 1
+
+            logger.info(f"Converting articles for {profile}")
+
+            try:
+                for hits in iterate_pit_hit_pages(
+                    config_options.es_conn,
+                    index_name,
+                    page_size,
+                    query={"term": {"profile": profile}},
+                ):
+                    for hit in hits:
+                        article_path = os.path.join(profile_path, f"{hit['_id']}.md")
+                        fingerprint = article_fingerprint(hit["_source"])
+
+                        if manifest.get(hit["_id"]) == fingerprint and os.path.exists(
+                            article_path
+                        ):
+                            skipped_count += 1
+                            continue
+
+                        future = executor.submit(render_article_md, hit, article_path)
+                        pending[future] = (hit["_id"], fingerprint)
+
+                        # Keep a bounded number of articles in flight, so a large profile isn't held in memory at once
+                        if len(pending) >= worker_count * 2:
+                            collect(FIRST_COMPLETED)
+
+                if pending:
+                    collect(ALL_COMPLETED)
+            finally:
+                write_file_atomically(manifest_path, json.dumps(manifest))
+
+    logger.info(
+        f"Wrote {written_count} markdown files and skipped {skipped_count} unchanged articles"
+    )
 
 
 current_day = datetime.today().strftime("%Y-%m-%d-%H:%M:%S")
@@ -125,32 +295,106 @@ current_day = datetime.today().strftime("%Y-%m-%d-%H:%M:%S")
 def backup(
     indicies: list[str] = [config_options.ELASTICSEARCH_ARTICLE_INDEX],
     backup_path: str = "./",
-    backup_file_name: str = f"elastic-backup-{current_day}.gz",
+    backup_file_name: str = f"elastic-backup-{current_day}.ndjson.gz",
+    page_size: int = 1000,
 ) -> None:
     backup_full_path = backup_path + backup_file_name
-    indicies_content: dict[str, list[dict[str, Any]]] = {}
+    es_conn = config_options.es_conn
 
-    for index_name in indicies:
-        logger.debug(f'Downloading articles for "{index_name}"')
-        article_client = return_article_db_conn(
-            config_options.es_conn,
-            index_name,
-            config_options.ELASTICSEARCH_ELSER_PIPELINE,
-            config_options.ELASTICSEARCH_ELSER_ID,
-        )
+    # Each index starts with a header holding its name and mappings, followed by a line for each of its documents
+    def backup_lines() -> Iterator[dict[str, Any]]:
+        for index_name in indicies:
+            logger.debug(f'Downloading documents for "{index_name}"')
 
-        articles = article_client.query_all_documents()
+            mappings = next(
+                iter(es_conn.indices.get_mapping(index=index_name).values())
+            )
+            yield {"index": index_name, "mappings": mappings["mappings"]}
 
-        logger.debug(
-            f'Downloaded {len(articles)} articles for "{index_name}". Converting'
-        )
+            document_count = 0
 
-        article_dicts = [
-            article.model_dump(exclude={"highlights"}, mode="json")
-            for article in articles
-        ]
-        indicies_content[index_name] = article_dicts
+            for hits in iterate_pit_hit_pages(es_conn, index_name, page_size):
+                for hit in hits:
+                    yield {"_id": hit["_id"], "_source": hit["_source"]}
+
+                document_count += len(hits)
+
+            logger.debug(f'Backed up {document_count} documents for "{index_name}"')
 
     logger.debug(f'Writing backup to disk at "{backup_full_path}"')
-    with gzip.open(backup_full_path, "wt", encoding="utf-8") as f:
-        json.dump(indicies_content, f)
+
+    with open_text(backup_full_path, "w") as f:
+        line_count = write_lines(f, backup_lines())
+
+    checksum = write_checksum(backup_full_path)
+
+    logger.info(
+        f'Wrote {line_count - len(indicies)} documents to "{backup_full_path}" with checksum {checksum}'
+    )
+
+
+@app.command()
+def restore(
+    backup_file: str,
+    threads: int = 4,
+    batch_size: int = 500,
+    skip_checksum: bool = False,
+) -> None:
+    es_conn = config_options.es_conn
+
+    if skip_checksum:
+        pass
+    elif not os.path.exists(f"{backup_file}.sha256"):
+        logger.warning(f'No checksum found for "{backup_file}", restoring anyway')
+    elif not verify_checksum(backup_file):
+        logger.error(f'Checksum for "{backup_file}" doesn\'t match, aborting restore')
+        raise typer.Exit(1)
+
+    def restore_actions(lines: Iterator[dict[str, Any]]) -> Iterator[dict[str, Any]]:
+        index_name: str | None = None
+
+        for line in lines:
+            if "index" in line:
+                index_name = line["index"]
+
+                if not es_conn.indices.exists(index=index_name):
+                    logger.info(
+                        f'Creating "{index_name}" index from backed up mappings'
+                    )
+                    es_conn.indices.create(index=index_name, mappings=line["mappings"])
+
+                continue
+
+            if index_name is None:
+                raise ValueError(f'"{backup_file}" is missing an index header')
+
+            yield {
+                "_op_type": "index",
+                "_index": index_name,
+                "_id": line["_id"],
+                "_source": line["_source"],
+            }
+
+    restored_counts: Counter[str] = Counter()
+    failed_count = 0
+
+    with open_text(backup_file, "r") as f:
+        for ok, item in helpers.parallel_bulk(
+            es_conn,
+            restore_actions(read_lines(f)),
+            thread_count=threads,
+            chunk_size=batch_size,
+            raise_on_error=False,
+            raise_on_exception=False,
+        ):
+            if ok:
+                restored_counts[item["index"]["_index"]] += 1
+            else:
+                failed_count += 1
+                logger.error(f"Failed restoring document: {item}")
+
+    for index_name, count in restored_counts.items():
+        logger.info(f'Restored {count} documents to "{index_name}"')
+
+    if failed_count:
+        logger.error(f"Failed restoring {failed_count} documents")
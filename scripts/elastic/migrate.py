@@ -1,22 +1,28 @@
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import json
 import logging
+import os
 from datetime import datetime, timezone
 from hashlib import md5
-from typing import Any, cast
-import multiprocessing
+from typing import Any, TypedDict, cast
 from tqdm import tqdm
 
 from pydantic import Field, ValidationError
 
+from elasticsearch import Elasticsearch, helpers
 import typer
 from rich import print_json
 
 from modules.elastic import ArticleSearchQuery, ElasticDB, return_article_db_conn
+from modules.misc import create_folder
 from modules.objects import BaseArticle, FullArticle, PartialArticle
 
-from .utils import get_user_yes_no
+from .utils import get_user_yes_no, iterate_hit_pages
 from .. import config_options
 from ..scraping.articles.text import (
     generate_tags,
+    get_common_words,
     locate_objects_of_interest,
     tokenize_text,
 )
@@ -74,27 +80,174 @@ def add_timezone() -> None:
     logger.debug(f"Saved {saved} articles")
 
 
-def article_tag_regen(article: FullArticle) -> FullArticle:
-    article.tags.automatic = generate_tags(tokenize_text(article.content))
-    article.tags.interesting = locate_objects_of_interest(article.content)
-    return article
+class RegenerateTagsCheckpoint(TypedDict):
+    index: str
+    search_after: list[Any]
+    processed: int
 
 
-@app.command()
-def regenerate_tags() -> None:
-    logger.debug("Downloading articles")
-    articles = config_options.es_article_client.query_all_documents()
+regenerate_tags_checkpoint_path = "./cache/regenerate_tags_checkpoint.json"
 
-    logger.debug(f"Converting {len(articles)} articles")
 
-    with multiprocessing.Pool(multiprocessing.cpu_count() - 2) as pool:
-        new_articles = list(
-            tqdm(pool.imap_unordered(article_tag_regen, articles), total=len(articles))
+def load_regenerate_tags_checkpoint(index: str) -> RegenerateTagsCheckpoint | None:
+    if not os.path.exists(regenerate_tags_checkpoint_path):
+        return None
+
+    with open(regenerate_tags_checkpoint_path, "r") as f:
+        checkpoint: RegenerateTagsCheckpoint = json.load(f)
+
+    if checkpoint["index"] != index:
+        logger.warning(
+            f'Ignoring checkpoint for the "{checkpoint["index"]}" index, as tags are being regenerated for "{index}"'
         )
+        return None
 
-    logger.debug("Saving articles")
-    saved = config_options.es_article_client.update_documents(new_articles, ["tags"])
-    logger.debug(f"Saved {saved} articles")
+    return checkpoint
+
+
+def save_regenerate_tags_checkpoint(checkpoint: RegenerateTagsCheckpoint) -> None:
+    create_folder(os.path.dirname(regenerate_tags_checkpoint_path), change_mode=False)
+
+    # Written to a temporary file first, so an interruption can't leave a half written checkpoint behind
+    temporary_path = f"{regenerate_tags_checkpoint_path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(checkpoint, f)
+
+    os.replace(temporary_path, regenerate_tags_checkpoint_path)
+
+
+# Runs in the worker processes. Only the id and content goes in, and only the new tags comes back out, to keep the
+# amount of data pickled between the processes down
+def regenerate_chunk_tags(
+    chunk: list[tuple[str, str]],
+) -> list[tuple[str, dict[str, Any]]]:
+    return [
+        (
+            article_id,
+            {
+                "automatic": generate_tags(tokenize_text(content)),
+                "interesting": [
+                    tag.model_dump(mode="json")
+                    for tag in locate_objects_of_interest(content)
+                ],
+            },
+        )
+        for article_id, content in chunk
+    ]
+
+
+# Partial updates are merged into the existing document, so any other fields under "tags" are left untouched
+def save_regenerated_tags(
+    es_conn: Elasticsearch, index: str, results: list[tuple[str, dict[str, Any]]]
+) -> int:
+    saved, errors = helpers.bulk(
+        es_conn,
+        (
+            {
+                "_op_type": "update",
+                "_index": index,
+                "_id": article_id,
+                "doc": {"tags": tags},
+            }
+            for article_id, tags in results
+        ),
+        raise_on_error=False,
+        raise_on_exception=False,
+    )
+
+    for error in cast(list[dict[str, Any]], errors):
+        logger.error(f"Failed saving regenerated tags: {error}")
+
+    return saved
+
+
+@app.command()
+def regenerate_tags(
+    workers: int | None = None,
+    page_size: int = 1000,
+    chunk_size: int = 100,
+    restart: bool = False,
+) -> None:
+    es_conn = config_options.es_conn
+    index = config_options.ELASTICSEARCH_ARTICLE_INDEX
+
+    # Leave a couple of cores for Elasticsearch and the main process, without going below a single worker
+    worker_count = workers or max((os.cpu_count() or 1) - 2, 1)
+
+    checkpoint = None if restart else load_regenerate_tags_checkpoint(index)
+
+    if checkpoint:
+        logger.info(
+            f"Resuming tag regeneration after {checkpoint['processed']} already processed articles"
+        )
+    else:
+        checkpoint = {"index": index, "search_after": [], "processed": 0}
+
+    total = es_conn.count(index=index)["count"]
+    search_after = checkpoint["search_after"] or None
+
+    def read_chunks() -> Iterator[tuple[list[tuple[str, str]], list[Any]]]:
+        for hits in iterate_hit_pages(
+            es_conn, index, ["content"], page_size, search_after
+        ):
+            for i in range(0, len(hits), chunk_size):
+                chunk_hits = hits[i : i + chunk_size]
+                yield [
+                    (hit["_id"], hit["_source"].get("content", ""))
+                    for hit in chunk_hits
+                ], chunk_hits[-1]["sort"]
+
+    chunks = enumerate(read_chunks())
+
+    # Chunks can finish out of order, so the checkpoint is only moved past a chunk once every chunk before it is saved
+    pending: dict[Future[list[tuple[str, dict[str, Any]]]], tuple[int, list[Any]]] = {}
+    finished: dict[int, tuple[list[Any], int]] = {}
+    next_checkpoint_chunk = 0
+    saved_count = 0
+
+    # Load the word list before forking, so the workers share it instead of each loading their own
+    get_common_words()
+
+    with ProcessPoolExecutor(worker_count) as executor, tqdm(
+        total=total, initial=checkpoint["processed"]
+    ) as progress:
+
+        # Only a couple of chunks per worker is read ahead, to keep memory use bounded no matter the size of the index
+        def submit_chunks() -> None:
+            while len(pending) < worker_count * 2:
+                next_chunk = next(chunks, None)
+                if next_chunk is None:
+                    return
+
+                chunk_number, (chunk, sort_values) = next_chunk
+                future = executor.submit(regenerate_chunk_tags, chunk)
+                pending[future] = (chunk_number, sort_values)
+
+        submit_chunks()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                chunk_number, sort_values = pending.pop(future)
+                results = future.result()
+
+                saved_count += save_regenerated_tags(es_conn, index, results)
+                finished[chunk_number] = (sort_values, len(results))
+                progress.update(len(results))
+
+            while next_checkpoint_chunk in finished:
+                sort_values, chunk_length = finished.pop(next_checkpoint_chunk)
+                checkpoint["search_after"] = sort_values
+                checkpoint["processed"] += chunk_length
+                next_checkpoint_chunk += 1
+
+            save_regenerate_tags_checkpoint(checkpoint)
+            submit_chunks()
+
+    if os.path.exists(regenerate_tags_checkpoint_path):
+        os.remove(regenerate_tags_checkpoint_path)
+    logger.info(f"Saved regenerated tags for {saved_count} articles")
 
 
 @app.command()
@@ -1,3 +1,9 @@
+from collections.abc import Iterator, Mapping, Sequence
+from typing import Any
+
+from elasticsearch import Elasticsearch
+
+
 def get_user_yes_no(prompt: str) -> bool:
     user_input: str = ""
     while True:
@@ -8,3 +14,77 @@ def get_user_yes_no(prompt: str) -> bool:
 
         print("Wrong answer")
     return user_input == "y"
+
+
+# Sorting on when the article was inserted, with the unique url as tiebreaker, gives every article a stable position
+# which new articles are appended after, so a page can be picked up again from its sort values even in a later run
+stable_article_sort: list[dict[str, str]] = [{"inserted_at": "asc"}, {"url": "asc"}]
+
+
+# Page through all documents in an index using search_after, yielding the raw hits one page at a time.
+# Only the given source fields are downloaded, and paging can be resumed by passing the sort values of the last hit
+def iterate_hit_pages(
+    es_conn: Elasticsearch,
+    index: str,
+    fields: Sequence[str] | None = None,
+    page_size: int = 1000,
+    search_after: list[Any] | None = None,
+) -> Iterator[list[dict[str, Any]]]:
+    while True:
+        response = es_conn.search(
+            index=index,
+            query={"match_all": {}},
+            sort=stable_article_sort,
+            source_includes=list(fields) if fields is not None else None,
+            size=page_size,
+            search_after=search_after,
+            track_total_hits=False,
+        )
+        hits: list[dict[str, Any]] = response["hits"]["hits"]
+
+        if not hits:
+            return
+
+        yield hits
+
+        search_after = hits[-1]["sort"]
+
+
+# Page through a consistent snapshot of an index using a point in time, which is cheaper than sorting on fields and
+# unaffected by documents being written while paging. The point in time is closed again once done.
+# Fields not needed can be left out of the downloaded source using source includes and excludes
+def iterate_pit_hit_pages(
+    es_conn: Elasticsearch,
+    index: str,
+    page_size: int = 1000,
+    keep_alive: str = "5m",
+    source_includes: Sequence[str] | None = None,
+    source_excludes: Sequence[str] | None = None,
+    query: Mapping[str, Any] | None = None,
+) -> Iterator[list[dict[str, Any]]]:
+    pit_id: str = es_conn.open_point_in_time(index=index, keep_alive=keep_alive)["id"]
+    search_after: list[Any] | None = None
+
+    try:
+        while True:
+            response = es_conn.search(
+                pit={"id": pit_id, "keep_alive": keep_alive},
+                query=query or {"match_all": {}},
+                sort=["_shard_doc"],
+                size=page_size,
+                search_after=search_after,
+                track_total_hits=False,
+                source_includes=list(source_includes) if source_includes else None,
+                source_excludes=list(source_excludes) if source_excludes else None,
+            )
+            hits: list[dict[str, Any]] = response["hits"]["hits"]
+
+            if not hits:
+                return
+
+            yield hits
+
+            pit_id = response.get("pit_id", pit_id)
+            search_after = hits[-1]["sort"]
+    finally:
+        es_conn.close_point_in_time(id=pit_id)
@@ -0,0 +1,128 @@
+import bz2
+import gzip
+import hashlib
+import itertools
+import json
+import lzma
+import re
+from collections.abc import Callable, Iterable, Iterator
+from typing import IO, Any, Literal
+
+# Compression is picked from the file extension, so both reading and writing can stream through the file
+compressors: dict[str, Callable[..., IO[str]]] = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+
+def open_text(path: str, mode: Literal["r", "w"]) -> IO[str]:
+    for extension, compressor in compressors.items():
+        if path.endswith(extension):
+            return compressor(path, f"{mode}t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+# Newline delimited JSON, with one object per line, allows handling a single document at a time when reading and writing
+def write_lines(f: IO[str], objects: Iterable[Any]) -> int:
+    count = 0
+
+    for obj in objects:
+        f.write(json.dumps(obj, default=str))
+        f.write("\n")
+        count += 1
+
+    return count
+
+
+# Writes a regular JSON array, one element at a time
+def write_array(f: IO[str], objects: Iterable[Any]) -> int:
+    count = 0
+
+    f.write("[")
+
+    for obj in objects:
+        if count:
+            f.write(", ")
+
+        f.write(json.dumps(obj, default=str))
+        count += 1
+
+    f.write("]")
+
+    return count
+
+
+def read_lines(f: Iterable[str]) -> Iterator[Any]:
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+# The checksum is stored next to the file in the format used by sha256sum, so it can also be checked by hand
+def write_checksum(path: str) -> str:
+    checksum = file_checksum(path)
+
+    with open(f"{path}.sha256", "w") as f:
+        f.write(f"{checksum}  {path.rsplit('/', 1)[-1]}\n")
+
+    return checksum
+
+
+def verify_checksum(path: str) -> bool:
+    with open(f"{path}.sha256", "r") as f:
+        expected = f.read().split()[0]
+
+    return file_checksum(path) == expected
+
+
+element_separator = re.compile(r"[\s,]*")
+
+
+# Reads the objects from either a JSON array or newline delimited JSON, without loading the whole file into memory.
+# Array elements are decoded one at a time from a rolling buffer, which only holds the blocks of the current element
+def read_documents(f: IO[str], block_size: int = 1024 * 1024) -> Iterator[Any]:
+    first_character = f.read(1)
+    while first_character.isspace():
+        first_character = f.read(1)
+
+    if first_character != "[":
+        yield from read_lines(itertools.chain([first_character + f.readline()], f))
+        return
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    at_end = False
+
+    while True:
+        separator = element_separator.match(buffer, position)
+        position = separator.end() if separator else position
+
+        if buffer.startswith("]", position):
+            return
+
+        try:
+            obj, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if at_end:
+                raise
+
+            block = f.read(block_size)
+            at_end = not block
+            buffer = buffer[position:] + block
+            position = 0
+            continue
+
+        yield obj
@@ -3,12 +3,21 @@ from modules.profiles import get_profile
 
 from scripts.profile_tester import calculate_profile, get_profile_prompt
 from scripts.scraping.articles import (
+    ArticlePage,
+    ParsedArticle,
     gather_profile_urls,
     scrape_articles,
     scrape_using_profile,
 )
-from scripts import config_options
-
+from scripts.scraping.articles.dedup import ArticleDeduplicator, SeenArticleIndex
+from scripts.scraping.articles.drivers import DriverPool
+from scripts.scraping.articles.engine import ScrapeEngine
+from scripts.scraping.articles.fetching import FetchStrategyStore
+from scripts.scraping.articles.pipeline import ScrapePipeline
+from scripts.scraping.articles.retrieval import ValidatorCache
+from scripts.scraping.articles.timing import recorder
+
+from rich.console import Console
 import typer
 
 
@@ -17,11 +26,67 @@ logger = logging.getLogger("osinter")
 
 
 @app.command()
-def main() -> None:
+def main(
+    workers: int = typer.Option(
+        4, help="Number of articles being scraped at the same time across all sites"
+    ),
+    per_domain: int = typer.Option(
+        2, help="Number of articles being scraped at the same time from a single site"
+    ),
+    domain_delay: float = typer.Option(
+        1.0, help="Minimum number of seconds between starting requests to a site"
+    ),
+    browser_count: int | None = typer.Option(
+        None,
+        help="Number of browser instances kept running for dynamic scraping, defaults to the number of workers",
+    ),
+    pages_per_browser: int = typer.Option(
+        50, help="Number of pages a browser instance renders before being restarted"
+    ),
+    parse_workers: int | None = typer.Option(
+        None,
+        help="Number of processes parsing fetched articles, defaults to the number of CPU cores",
+    ),
+    parse_queue_size: int | None = typer.Option(
+        None,
+        help="Number of fetched articles waiting to be parsed or stored before fetching pauses, defaults to twice the number of parse workers",
+    ),
+    timings_file: str | None = typer.Option(
+        "./logs/scrape-timings.jsonl",
+        help="JSON lines file for writing the time spent in each stage for each article",
+    ),
+    prometheus_file: str | None = typer.Option(
+        None,
+        help="File for writing a summary of the time spent in each stage, in the Prometheus text format",
+    ),
+) -> None:
+    recorder.clear()
+
     for scraping_function in [scrape_articles]:
         try:
             logger.info(f'Running the "{scraping_function.__name__}" function.')
-            scraping_function()
+            strategy_store = FetchStrategyStore()
+            validator_cache = ValidatorCache()
+            pipeline: ScrapePipeline[ArticlePage, ParsedArticle] = ScrapePipeline(
+                ScrapeEngine(workers, per_domain, domain_delay),
+                parse_workers,
+                parse_queue_size,
+            )
+            deduplicator = ArticleDeduplicator(SeenArticleIndex())
+
+            with DriverPool(browser_count or workers, pages_per_browser) as driver_pool:
+                try:
+                    scraping_function(
+                        driver_pool,
+                        strategy_store,
+                        pipeline,
+                        validator_cache,
+                        deduplicator,
+                    )
+                finally:
+                    strategy_store.save()
+                    validator_cache.save()
+                    deduplicator.save()
 
         except Exception as e:
             logger.critical(
@@ -29,6 +94,14 @@ def main() -> None:
                 exc_info=True,
             )
 
+    if timings_file:
+        recorder.write_json_lines(timings_file)
+    if prometheus_file:
+        recorder.write_prometheus(prometheus_file)
+
+    if recorder.spans():
+        Console().print(recorder.summary_table())
+
 
 @app.command()
 def timetravel(
@@ -43,21 +116,31 @@ def timetravel(
         raise Exception("Need a % for substituting the page number")
 
     current_profile = get_profile(profile)
+    strategy_store = FetchStrategyStore()
+    deduplicator = ArticleDeduplicator(SeenArticleIndex())
 
-    while True:
-        logger.info(f"Scraping page {start_page} to {start_page + batch_size}")
+    with DriverPool() as driver_pool:
+        while True:
+            logger.info(f"Scraping page {start_page} to {start_page + batch_size}")
 
-        frontpage_urls = [
-            url.replace("%", str(i)) for i in range(start_page, start_page + batch_size)
-        ]
+            frontpage_urls = [
+                url.replace("%", str(i))
+                for i in range(start_page, start_page + batch_size)
+            ]
 
-        urls = gather_profile_urls(current_profile, 1000, frontpage_urls)
+            urls = gather_profile_urls(
+                current_profile, 1000, frontpage_urls, driver_pool=driver_pool
+            )
 
-        logger.debug(
-            "Removing those articles that have already been stored in the database"
-        )
+            logger.debug(
+                "Removing those articles that have already been stored in the database"
+            )
 
-        filtered_urls = config_options.es_article_client.filter_document_list(urls)
-        scrape_using_profile(filtered_urls, profile)
+            filtered_urls = deduplicator.filter_urls(urls)
+            scrape_using_profile(
+                filtered_urls, profile, driver_pool, strategy_store, deduplicator
+            )
+            strategy_store.save()
+            deduplicator.save()
 
-        start_page += batch_size
+            start_page += batch_size
@@ -1,6 +1,6 @@
-from hashlib import md5
+import asyncio
 import logging
-from typing import Any, cast
+from typing import Any, NamedTuple, cast
 
 from bs4 import BeautifulSoup as bs
 from markdownify import MarkdownConverter  # type: ignore
@@ -9,13 +9,36 @@ from pydantic import HttpUrl
 from modules.objects import FullArticle, Tags
 from modules.profiles import Profile, get_profile, get_profiles
 
-from .text import clean_text, generate_tags, locate_objects_of_interest, tokenize_text
-from .extract import extract_article_content, extract_meta_information
+from .text import (
+    clean_text,
+    generate_tags,
+    get_common_words,
+    locate_objects_of_interest,
+    tokenize_text,
+)
+from .dates import load_dateparser
+from .dedup import ArticleDeduplicator, article_id
+from .drivers import DriverPool
+from .extract import extract_article_fragment, extract_meta_information
+from .fetching import (
+    FetchStrategyStore,
+    PageMismatchError,
+    fetch_article_page,
+    fetch_article_soup,
+    fetch_dynamic_page,
+    page_matches_profile,
+)
+from .parsing import parse_html
+from .pipeline import ScrapePipeline
+from .retrieval import AsyncFetcher, ValidatorCache
 from .scraping import (
     get_article_urls_from_rss,
     scrape_article_urls,
     scrape_page_dynamic,
 )
+from .timing import Span, collect_spans, recorder, span
+from .waiting import get_wait_settings
+from .writer import BulkArticleWriter
 
 from scripts import config_options
 
@@ -32,8 +55,12 @@ class custom_md_converter(MarkdownConverter):  # type: ignore
         return cast(str, super().convert_a(el, text, parent_tags))
 
 
-def gather_profile_urls(
-    profile: Profile, max_url_count: int, news_paths: list[str] | None = None
+async def gather_profile_urls_async(
+    profile: Profile,
+    max_url_count: int,
+    fetcher: AsyncFetcher,
+    news_paths: list[str] | None = None,
+    driver_pool: DriverPool | None = None,
 ) -> list[str]:
     profile_name = profile.source.profile_name
     news_paths = news_paths if news_paths else profile.source.news_paths
@@ -42,17 +69,64 @@ def gather_profile_urls(
 
     if profile.source.retrieval_method == "rss":
         logger.debug("Using RSS for gathering links.\n")
-        return get_article_urls_from_rss(news_paths, max_url_count)
+
+        rss_links = await asyncio.gather(
+            *[
+                fetcher.fetch_links(
+                    url,
+                    max_url_count,
+                    lambda feed: get_article_urls_from_rss([feed], max_url_count),
+                )
+                for url in news_paths
+            ]
+        )
+        return [link for links in rss_links if links is not None for link in links]
 
     elif profile.source.retrieval_method == "scraping":
         logger.debug("Using scraping for gathering links.\n")
-        return scrape_article_urls(profile, max_url_count, news_paths=news_paths)
+
+        frontpage_links = await asyncio.gather(
+            *[
+                fetcher.fetch_links(
+                    url,
+                    max_url_count,
+                    lambda frontpage: scrape_article_urls(
+                        profile,
+                        max_url_count,
+                        web_soups=[parse_html(frontpage)],
+                    ),
+                )
+                for url in news_paths
+            ]
+        )
+
+        if None in frontpage_links:
+            raise Exception(f"Error when scraping article urls from {profile_name}")
+
+        # Flatten and remove duplicates
+        return list(
+            {link for links in cast(list[list[str]], frontpage_links) for link in links}
+        )
 
     elif profile.source.retrieval_method == "dynamic":
         logger.debug("Using dynamic scraping for gathering links.\n")
 
-        article_sources = [scrape_page_dynamic(url, []) for url in news_paths]
-        frontpage_soups = [bs(source, "html.parser") for source in article_sources]
+        # The browser is blocking, so it's run in threads to not hold up the other profiles
+        article_sources = await asyncio.gather(
+            *[
+                asyncio.to_thread(
+                    scrape_page_dynamic,
+                    url,
+                    [],
+                    driver_pool=driver_pool,
+                    wait_settings=get_wait_settings(profile.source.profile_name),
+                    content_selector=profile.source.scraping_targets.link_containers,
+                    profile_name=profile.source.profile_name,
+                )
+                for url in news_paths
+            ]
+        )
+        frontpage_soups = [parse_html(source) for source in article_sources]
 
         return scrape_article_urls(
             profile,
@@ -63,66 +137,195 @@ def gather_profile_urls(
         raise NotImplementedError
 
 
-# Function for gathering list of URLs for articles from newssite
+def gather_profile_urls(
+    profile: Profile,
+    max_url_count: int,
+    news_paths: list[str] | None = None,
+    driver_pool: DriverPool | None = None,
+    validator_cache: ValidatorCache | None = None,
+) -> list[str]:
+    async def gather() -> list[str]:
+        async with AsyncFetcher(validator_cache=validator_cache) as fetcher:
+            return await gather_profile_urls_async(
+                profile, max_url_count, fetcher, news_paths, driver_pool
+            )
+
+    return asyncio.run(gather())
+
+
+# Function for gathering list of URLs for articles from newssite. All profiles are gathered in parallel over shared connections
 def gather_profiles_urls(
-    profiles: list[Profile], max_url_count: int = 10
+    profiles: list[Profile],
+    max_url_count: int = 10,
+    driver_pool: DriverPool | None = None,
+    validator_cache: ValidatorCache | None = None,
 ) -> dict[str, list[str]]:
-    article_urls: dict[str, list[str]] = {}
-
-    for profile in profiles:
+    async def gather_single(profile: Profile, fetcher: AsyncFetcher) -> list[str]:
         profile_name = profile.source.profile_name
         try:
-            article_urls[profile_name] = gather_profile_urls(profile, max_url_count)
+            return await gather_profile_urls_async(
+                profile, max_url_count, fetcher, driver_pool=driver_pool
+            )
         except Exception:
-            article_urls[profile_name] = []
             logger.exception(
                 f'Problem with gathering URLs for the "{profile_name}" profile. Skipping for now'
             )
+            return []
+
+    async def gather_all() -> dict[str, list[str]]:
+        async with AsyncFetcher(validator_cache=validator_cache) as fetcher:
+            article_urls = await asyncio.gather(
+                *[gather_single(profile, fetcher) for profile in profiles]
+            )
+
+        return {
+            profile.source.profile_name: urls
+            for profile, urls in zip(profiles, article_urls)
+        }
+
+    article_urls = asyncio.run(gather_all())
+
+    if validator_cache:
+        logger.info(
+            f"Validator cache had {validator_cache.hits} hits and {validator_cache.misses} misses while gathering URLs"
+        )
 
     return article_urls
 
 
-def handle_single_article(url: str, current_profile: Profile) -> FullArticle:
-    # Scrape the whole article source based on how the profile says
-    articles_source = scrape_page_dynamic(url, current_profile.scraping.js_injections)
-    article_soup = bs(articles_source, "html.parser")
+# Turn a fetched article page into an article, doing all the parsing, conversion and tag generation
+def build_article(url: str, current_profile: Profile, article_soup: bs) -> FullArticle:
+    profile_name = current_profile.source.profile_name
 
-    article_meta = extract_meta_information(
-        article_soup,
-        current_profile.scraping.meta,
-        current_profile.source.address,
-    )
+    with span("extract_meta_information", profile_name, url):
+        article_meta = extract_meta_information(
+            article_soup,
+            current_profile.scraping.meta,
+            current_profile.source.address,
+            profile_name,
+        )
 
-    article_text, article_clear_text = extract_article_content(
-        current_profile.scraping.content, article_soup
-    )
+    with span("extract_article_content", profile_name, url):
+        article_fragment, article_clear_text = extract_article_fragment(
+            current_profile.scraping.content, article_soup
+        )
 
     article_clear_text = clean_text(article_clear_text)
 
+    with span("markdown_conversion", profile_name, url):
+        formatted_content = custom_md_converter(
+            heading_close="closed_atx"
+        ).convert_soup(article_fragment)
+
+    with span("generate_tags", profile_name, url):
+        automatic_tags = generate_tags(tokenize_text(article_clear_text))
+
+    with span("locate_objects_of_interest", profile_name, url):
+        interesting_tags = locate_objects_of_interest(article_clear_text)
+
     current_article = FullArticle(
-        id=md5(str(url).encode("utf-8")).hexdigest(),
+        id=article_id(url),
         title=article_meta.title,
         description=article_meta.description,
         image_url=article_meta.image_url,
         publish_date=article_meta.publish_date,
         author=article_meta.author,
         url=url,
-        profile=current_profile.source.profile_name,
+        profile=profile_name,
         source=current_profile.source.name,
         content=article_clear_text,
-        formatted_content=custom_md_converter(heading_close="closed_atx").convert(
-            article_text
-        ),
-        tags=Tags(
-            automatic=generate_tags(tokenize_text(article_clear_text)),
-            interesting=locate_objects_of_interest(article_clear_text),
-        ),
+        formatted_content=formatted_content,
+        tags=Tags(automatic=automatic_tags, interesting=interesting_tags),
     )
 
     return current_article
 
 
-def scrape_using_profile(article_url_list: list[str], profile_name: str) -> None:
+def handle_single_article(
+    url: str,
+    current_profile: Profile,
+    driver_pool: DriverPool | None = None,
+    strategy_store: FetchStrategyStore | None = None,
+) -> FullArticle:
+    # Fetch the whole article source, only using the browser when the profile needs it
+    with span("fetch", current_profile.source.profile_name, url):
+        article_soup = fetch_article_soup(
+            url, current_profile, strategy_store, driver_pool
+        )
+
+    return build_article(url, current_profile, article_soup)
+
+
+class ArticlePage(NamedTuple):
+    url: str
+    profile: Profile
+    source: str | bytes
+    # Static pages which haven't been checked against the profile yet
+    unverified: bool
+    # Pages fetched using the browser after the static page didn't match, which are checked for settling on a strategy
+    fallback: bool = False
+
+
+class ParsedArticle(NamedTuple):
+    article: FullArticle
+    # The timings are sent back along with the article, as the parsing processes can't record them directly
+    spans: list[Span]
+    # Whether the page matched the profile, for the pages that were checked
+    matches_profile: bool | None = None
+
+
+# Runs in the parsing processes of the scrape pipeline. Pages are checked against the profile here, so they are only
+# parsed once
+def parse_article_page(page: ArticlePage) -> ParsedArticle:
+    profile_name = page.profile.source.profile_name
+    matches_profile: bool | None = None
+
+    with collect_spans() as spans:
+        with span("parse_html", profile_name, page.url):
+            article_soup = parse_html(page.source)
+
+        if page.unverified or page.fallback:
+            matches_profile = page_matches_profile(article_soup, page.profile)
+
+        if page.unverified and not matches_profile:
+            raise PageMismatchError(
+                f'Statically fetched page doesn\'t match the "{profile_name}" profile'
+            )
+
+        article = build_article(page.url, page.profile, article_soup)
+
+    return ParsedArticle(article, spans, matches_profile)
+
+
+def scrape_and_store_article(
+    url: str,
+    current_profile: Profile,
+    driver_pool: DriverPool | None = None,
+    strategy_store: FetchStrategyStore | None = None,
+    writer: BulkArticleWriter | None = None,
+) -> None:
+    try:
+        current_article = handle_single_article(
+            url, current_profile, driver_pool, strategy_store
+        )
+
+        if writer:
+            writer.add(current_article)
+        else:
+            config_options.es_article_client.save_document(current_article)
+    except Exception:
+        logger.exception(
+            f'Encountered problem with article with URL "{url}", skipping for now'
+        )
+
+
+def scrape_using_profile(
+    article_url_list: list[str],
+    profile_name: str,
+    driver_pool: DriverPool | None = None,
+    strategy_store: FetchStrategyStore | None = None,
+    deduplicator: ArticleDeduplicator | None = None,
+) -> None:
     logger.info(
         f'Scraping {len(article_url_list)} articles using the "{profile_name}" profile.'
     )
@@ -130,37 +333,45 @@ def scrape_using_profile(article_url_list: list[str], profile_name: str) -> None
     # Loading the profile for the current website
     current_profile = get_profile(profile_name)
 
-    for i, url in enumerate(article_url_list):
-        logger.debug(
-            f"Scraping article number {i + 1} with the injections "
-            + " ".join(current_profile.scraping.js_injections)
-            + f"and following URL: {url}."
-        )
-        try:
-            current_article = handle_single_article(url, current_profile)
-            config_options.es_article_client.save_document(current_article)
-        except Exception:
-            logger.exception(
-                f'Encountered problem with article with URL "{url}", skipping for now'
+    with BulkArticleWriter(
+        on_saved=deduplicator.mark_stored if deduplicator else None
+    ) as writer:
+        for i, url in enumerate(article_url_list):
+            logger.debug(
+                f"Scraping article number {i + 1} with the injections "
+                + " ".join(current_profile.scraping.js_injections)
+                + f"and following URL: {url}."
+            )
+            scrape_and_store_article(
+                url, current_profile, driver_pool, strategy_store, writer
             )
 
 
-def scrape_articles() -> None:
+def scrape_articles(
+    driver_pool: DriverPool | None = None,
+    strategy_store: FetchStrategyStore | None = None,
+    pipeline: ScrapePipeline[ArticlePage, ParsedArticle] | None = None,
+    validator_cache: ValidatorCache | None = None,
+    deduplicator: ArticleDeduplicator | None = None,
+) -> None:
+    deduplicator = deduplicator if deduplicator else ArticleDeduplicator()
+    strategy_store = strategy_store if strategy_store else FetchStrategyStore(None)
+    profiles = {profile.source.profile_name: profile for profile in get_profiles()}
+
     logger.debug("Scraping articles from frontpages and RSS feeds")
-    article_url_collection = gather_profiles_urls(get_profiles())
+    article_url_collection = gather_profiles_urls(
+        list(profiles.values()),
+        driver_pool=driver_pool,
+        validator_cache=validator_cache,
+    )
 
     logger.debug(
         "Removing those articles that have already been stored in the database"
     )
 
-    filtered_article_url_collection: dict[str, list[str]] = {}
-
-    for articles_source in article_url_collection:
-        filtered_article_url_collection[articles_source] = (
-            config_options.es_article_client.filter_document_list(
-                article_url_collection[articles_source]
-            )
-        )
+    filtered_article_url_collection = deduplicator.filter_collection(
+        article_url_collection
+    )
 
     article_number_after_filter = sum(
         [
@@ -177,8 +388,71 @@ def scrape_articles() -> None:
             f"Found {article_number_after_filter} articles left to scrape, will begin that process now"
         )
 
-    # Looping through the list of articles from specific news site in the list of all articles from all sites
-    for profile_name in filtered_article_url_collection:
-        scrape_using_profile(
-            filtered_article_url_collection[profile_name], profile_name
+    # URLs whose static page didn't match the profile, which are fetched again using the browser
+    fetch_dynamically: set[str] = set()
+
+    def fetch(profile_name: str, url: str) -> ArticlePage:
+        if url in fetch_dynamically:
+            with span("fetch", profile_name, url):
+                page_source = fetch_dynamic_page(
+                    url, profiles[profile_name], driver_pool
+                )
+
+            return ArticlePage(url, profiles[profile_name], page_source, False, True)
+
+        with span("fetch", profile_name, url):
+            page = fetch_article_page(
+                url, profiles[profile_name], strategy_store, driver_pool, False
+            )
+
+        return ArticlePage(url, profiles[profile_name], page.source, page.unverified)
+
+    def on_error(page: ArticlePage, e: Exception) -> None:
+        logger.error(
+            f'Encountered problem with article with URL "{page.url}", skipping for now',
+            exc_info=e,
+        )
+
+    # The profile might not work statically anymore, so the page is fetched again using the browser, which settles the
+    # strategy for the profile once it's parsed
+    def retry(page: ArticlePage, e: Exception) -> bool:
+        if not isinstance(e, PageMismatchError):
+            return False
+
+        logger.debug(
+            f'Static page for "{page.url}" didn\'t match the profile, fetching it again using the browser'
+        )
+        fetch_dynamically.add(page.url)
+        return True
+
+    # Load the word list and dateparser before the parsing processes are forked, so they share them instead of each
+    # loading their own
+    get_common_words()
+    load_dateparser()
+
+    # Fetching the articles from all sites concurrently, with the engine taking care of not overloading any single
+    # site, while the articles already fetched are parsed and stored
+    pipeline = pipeline if pipeline else ScrapePipeline()
+
+    # The parsing processes are forked when entering the pipeline, which is done before the writer starts its thread
+    with pipeline, BulkArticleWriter(on_saved=deduplicator.mark_stored) as writer:
+
+        def store(page: ArticlePage, parsed: ParsedArticle) -> None:
+            recorder.record(parsed.spans)
+            writer.add(parsed.article)
+
+            profile_name = page.profile.source.profile_name
+
+            if page.unverified:
+                strategy_store.remember(profile_name, "static")
+            elif page.fallback and parsed.matches_profile is not None:
+                strategy_store.settle(profile_name, parsed.matches_profile)
+
+        pipeline.run(
+            filtered_article_url_collection,
+            fetch,
+            parse_article_page,
+            store,
+            on_error,
+            retry,
         )
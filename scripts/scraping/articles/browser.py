@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+from typing import Any, NamedTuple
+from urllib.parse import quote, urlparse
+from urllib.request import getproxies
+
+logger = logging.getLogger("osinter")
+
+# Ad, analytics and tracking hosts, which never contribute to the article itself. Subdomains are blocked as well
+default_blocked_domains = (
+    "2mdn.net",
+    "adnxs.com",
+    "adsafeprotected.com",
+    "amazon-adsystem.com",
+    "chartbeat.com",
+    "chartbeat.net",
+    "criteo.com",
+    "criteo.net",
+    "doubleclick.net",
+    "facebook.net",
+    "google-analytics.com",
+    "googleadservices.com",
+    "googlesyndication.com",
+    "googletagservices.com",
+    "hotjar.com",
+    "moatads.com",
+    "outbrain.com",
+    "quantserve.com",
+    "rubiconproject.com",
+    "scorecardresearch.com",
+    "taboola.com",
+)
+
+
+# PAC results for reaching the proxies given by the environment, like HTTPS_PROXY and ALL_PROXY, keyed by the scheme
+# of the URLs they are used for, along with the hosts that NO_PROXY says to connect to directly
+def upstream_proxies() -> tuple[dict[str, str], list[str]]:
+    proxies = getproxies()
+    default_ports = {"http": 80, "https": 443}
+    pac_types = {
+        "http": "PROXY",
+        "https": "HTTPS",
+        "socks4": "SOCKS",
+        "socks4a": "SOCKS",
+    }
+
+    upstream: dict[str, str] = {}
+
+    for scheme in ("http", "https", "all"):
+        if not (proxy := proxies.get(scheme)):
+            continue
+
+        parsed = urlparse(proxy if "://" in proxy else f"http://{proxy}")
+
+        if not parsed.hostname:
+            logger.warning(f'Ignoring invalid {scheme} proxy "{proxy}"')
+            continue
+
+        pac_type = pac_types.get(parsed.scheme, "SOCKS5")
+        port = parsed.port or default_ports.get(parsed.scheme, 1080)
+        upstream[scheme] = f"{pac_type} {parsed.hostname}:{port}"
+
+    bypassed: list[str] = []
+
+    for host in proxies.get("no", "").split(","):
+        host = host.strip()
+
+        if host == "*":
+            bypassed.append(host)
+        elif host:
+            bypassed.append(host.lstrip("*.").split(":")[0])
+
+    return upstream, bypassed
+
+
+# Which resources the browser skips downloading, since only the HTML of the page is used. Profiles whose pages don't
+# render properly without everything loaded can be left unblocked
+class BrowserConfig(NamedTuple):
+    block_images: bool = True
+    block_fonts: bool = True
+    block_media: bool = True
+    block_stylesheets: bool = False
+    block_trackers: bool = True
+    blocked_domains: tuple[str, ...] = default_blocked_domains
+    unblocked_profiles: frozenset[str] = frozenset()
+
+    def blocks_resources_for(self, profile_name: str | None) -> bool:
+        return profile_name not in self.unblocked_profiles
+
+    # Firefox preferences for browsers blocking resources
+    def preferences(self) -> dict[str, str | int | bool]:
+        preferences: dict[str, str | int | bool] = {
+            "network.prefetch-next": False,
+            "network.dns.disablePrefetch": True,
+        }
+
+        if self.block_images:
+            preferences["permissions.default.image"] = 2
+
+        if self.block_fonts:
+            preferences["gfx.downloadable_fonts.enabled"] = False
+
+        if self.block_media:
+            preferences["media.autoplay.default"] = 5
+            preferences["media.preload.default"] = 0
+            preferences["media.preload.auto"] = 0
+
+        if self.block_stylesheets:
+            preferences["permissions.default.stylesheet"] = 2
+
+        if self.block_trackers:
+            preferences["privacy.trackingprotection.enabled"] = True
+            preferences["privacy.trackingprotection.socialtracking.enabled"] = True
+            preferences["privacy.trackingprotection.cryptomining.enabled"] = True
+            preferences["privacy.trackingprotection.fingerprinting.enabled"] = True
+
+        if self.blocked_domains:
+            # Requests to blocked domains are sent through a proxy that isn't there, which fails them before any
+            # connection is made, without falling back to connecting directly. As this replaces the proxy settings the
+            # browser would otherwise use, everything else is sent through the proxy given by the environment, if any.
+            # Setting blocked_domains to an empty list leaves the proxy settings alone
+            preferences["network.proxy.type"] = 2
+            preferences["network.proxy.autoconfig_url"] = (
+                f"data:application/x-ns-proxy-autoconfig,{quote(self.proxy_autoconfig())}"
+            )
+            preferences["network.proxy.failover_direct"] = False
+
+        return preferences
+
+    def proxy_autoconfig(self) -> str:
+        upstream, bypassed = upstream_proxies()
+        all_upstream = upstream.get("all", "DIRECT")
+
+        return f"""
+function FindProxyForURL(url, host) {{
+    const blockedDomains = {json.dumps(list(self.blocked_domains))};
+    const bypassedDomains = {json.dumps(bypassed)};
+
+    for (const domain of blockedDomains) {{
+        if (host === domain || dnsDomainIs(host, "." + domain)) {{
+            return "PROXY 127.0.0.1:9";
+        }}
+    }}
+
+    for (const domain of bypassedDomains) {{
+        if (domain === "*" || host === domain || dnsDomainIs(host, "." + domain)) {{
+            return "DIRECT";
+        }}
+    }}
+
+    if (url.startsWith("https:")) {{
+        return {json.dumps(upstream.get("https", all_upstream))};
+    }}
+
+    return {json.dumps(upstream.get("http", all_upstream))};
+}}
+"""
+
+
+# Blocking can be adjusted in a file next to the profiles, like:
+# {"block_stylesheets": true, "blocked_domains": ["example.com"], "unblocked_profiles": ["profile_name"]}
+browser_config_path = "./profiles/browser_config.json"
+
+
+def load_browser_config(path: str = browser_config_path) -> BrowserConfig:
+    if not os.path.exists(path):
+        return BrowserConfig()
+
+    with open(path, "r") as f:
+        stored: dict[str, Any] = json.load(f)
+
+    unknown_options = set(stored) - set(BrowserConfig._fields)
+    if unknown_options:
+        logger.warning(
+            f'Ignoring unknown browser options {", ".join(sorted(unknown_options))} in "{path}"'
+        )
+
+    config = BrowserConfig()._replace(
+        **{
+            option: value
+            for option, value in stored.items()
+            if option in BrowserConfig._fields
+        }
+    )
+
+    return config._replace(
+        blocked_domains=tuple(config.blocked_domains),
+        unblocked_profiles=frozenset(config.unblocked_profiles),
+    )
@@ -0,0 +1,145 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import cache
+import logging
+import re
+import threading
+import time
+from typing import Callable, cast
+
+from .timing import record_span
+
+logger = logging.getLogger("osinter")
+
+iso_date = re.compile(r"\d{4}-\d{2}-\d{2}")
+# Only zone names email.utils knows are accepted, as it silently drops others like CEST or JST, leaving the date without
+# any offset. Dates using those are left to dateparser instead
+rfc_2822_date = re.compile(
+    r"(?:[A-Za-z]{3},\s*)?\d{1,2}\s+[A-Za-z]{3}\s+\d{4}\s+\d{1,2}:\d{2}(?::\d{2})?\s+(?:[+-]\d{4}|UTC?|GMT|Z|[ECMP][SD]T)"
+)
+
+
+# Importing dateparser is slow, so it's only done once it's actually needed
+@cache
+def load_dateparser() -> Callable[[str], datetime | None]:
+    from dateparser import parse as date_parse
+
+    return cast(Callable[[str], datetime | None], date_parse)
+
+
+# Formats commonly used by news sites, which are tried against dates dateparser had to handle, so the format can be used
+# directly for the next dates from the same profile. Formats with both the day and month as numbers are left out, as
+# dateparser decides between them for every date on its own, which a single remembered format couldn't match
+candidate_formats = [
+    "%B %d, %Y",
+    "%B %d, %Y %I:%M %p",
+    "%B %d, %Y at %I:%M %p",
+    "%b %d, %Y",
+    "%b. %d, %Y",
+    "%b %d, %Y %I:%M %p",
+    "%A, %B %d, %Y",
+    "%A, %B %d, %Y - %H:%M",
+    "%A %d %B %Y %H:%M",
+    "%d %B %Y",
+    "%d %B %Y %H:%M",
+    "%d %b %Y",
+    "%d %b %Y %H:%M",
+    "%d %b %Y %H:%M:%S",
+    "%Y/%m/%d",
+    "%Y/%m/%d %H:%M",
+    "%Y-%m-%d %H:%M:%S %z",
+]
+
+
+# Parses publish dates through the cheapest way that works: ISO-8601 and RFC-2822 dates are parsed directly, dates in a
+# format seen before from the same profile are parsed with that format, and only the rest are left to dateparser, which
+# has to guess at the language and format. How often each way is used is counted, and recorded as timing spans
+class DateParser:
+    def __init__(self, max_formats_per_profile: int = 5) -> None:
+        self.max_formats_per_profile = max_formats_per_profile
+        self.hits: Counter[str] = Counter()
+
+        self._lock = threading.Lock()
+        self._formats: defaultdict[str | None, list[str]] = defaultdict(list)
+
+    def parse(
+        self, date_string: str, profile_name: str | None = None
+    ) -> datetime | None:
+        start = time.perf_counter()
+        method, parsed = self._parse(date_string.strip(), profile_name)
+
+        with self._lock:
+            self.hits[method] += 1
+
+        record_span(f"parse_date_{method}", time.perf_counter() - start, profile_name)
+
+        return parsed
+
+    def _parse(
+        self, date_string: str, profile_name: str | None
+    ) -> tuple[str, datetime | None]:
+        if iso_date.match(date_string):
+            try:
+                return "iso", datetime.fromisoformat(date_string)
+            except ValueError:
+                pass
+
+        if rfc_2822_date.fullmatch(date_string):
+            try:
+                return "rfc_2822", parsedate_to_datetime(date_string)
+            except (TypeError, ValueError):
+                pass
+
+        with self._lock:
+            formats = list(self._formats[profile_name])
+
+        for date_format in formats:
+            try:
+                parsed = datetime.strptime(date_string, date_format)
+            except ValueError:
+                continue
+
+            self._remember(profile_name, date_format)
+            return "learned", parsed
+
+        guessed = load_dateparser()(date_string)
+
+        if guessed is None:
+            return "failed", None
+
+        self._learn(date_string, guessed, profile_name)
+        return "dateparser", guessed
+
+    # Only formats giving exactly the same date as dateparser are remembered
+    def _learn(
+        self, date_string: str, parsed: datetime, profile_name: str | None
+    ) -> None:
+        for date_format in candidate_formats:
+            try:
+                if datetime.strptime(date_string, date_format) == parsed:
+                    self._remember(profile_name, date_format)
+                    return
+            except ValueError:
+                continue
+
+    # Most recently used formats are tried first, and the least recently used are dropped
+    def _remember(self, profile_name: str | None, date_format: str) -> None:
+        with self._lock:
+            formats = self._formats[profile_name]
+
+            if formats and formats[0] == date_format:
+                return
+
+            if date_format in formats:
+                formats.remove(date_format)
+            else:
+                logger.debug(
+                    f'Learned date format "{date_format}" for the "{profile_name}" profile'
+                )
+
+            formats.insert(0, date_format)
+            del formats[self.max_formats_per_profile :]
+
+
+date_parser = DateParser()
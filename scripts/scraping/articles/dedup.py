@@ -0,0 +1,157 @@
+from bisect import bisect_left
+from collections.abc import Iterable
+from hashlib import md5
+import logging
+import os
+import threading
+
+from modules.misc import create_folder
+from modules.objects import FullArticle
+
+from scripts import config_options
+
+logger = logging.getLogger("osinter")
+
+digest_size = md5().digest_size
+
+
+# Articles are stored with the md5 hash of their URL as id
+def article_id(url: str) -> str:
+    return md5(str(url).encode("utf-8")).hexdigest()
+
+
+# Read-only view of a sorted run of packed digests, which bisect can search directly without unpacking it
+class PackedDigests:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data) // digest_size
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.data[i * digest_size : (i + 1) * digest_size]
+
+    def __contains__(self, digest: object) -> bool:
+        if not isinstance(digest, bytes):
+            return False
+
+        i = bisect_left(self, digest)
+        return i < len(self) and self[i] == digest
+
+
+# On-disk set of the ids of articles known to be stored, kept as a sorted file of raw md5 digests. It's exact, unlike a
+# bloom filter, so a new article is never mistaken for a stored one, while only taking up 16 bytes per article.
+# Articles deleted from the database will still be seen as stored, until the file is removed
+class SeenArticleIndex:
+    def __init__(self, path: str | None = "./cache/seen_article_ids.bin") -> None:
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._stored = PackedDigests(b"")
+        self._added: set[bytes] = set()
+
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                self._stored = PackedDigests(f.read())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._stored) + len(self._added)
+
+    def __contains__(self, id: str) -> bool:
+        digest = bytes.fromhex(id)
+
+        with self._lock:
+            return digest in self._added or digest in self._stored
+
+    def add(self, ids: Iterable[str]) -> None:
+        digests = {bytes.fromhex(id) for id in ids}
+
+        with self._lock:
+            self._added.update(digests)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            create_folder(folder, change_mode=False)
+
+        with self._lock:
+            if not self._added:
+                return
+
+            merged = sorted(
+                self._added.union(self._stored[i] for i in range(len(self._stored)))
+            )
+            self._stored = PackedDigests(b"".join(merged))
+            self._added = set()
+
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(self._stored.data)
+
+            os.replace(temporary_path, self.path)
+
+
+# Filters out URLs of articles which have already been stored. URLs are first checked against the local index, and
+# only the remaining ones are looked up in Elasticsearch, in chunks small enough for a single terms query
+class ArticleDeduplicator:
+    def __init__(
+        self, seen_index: SeenArticleIndex | None = None, chunk_size: int = 1000
+    ) -> None:
+        self.seen_index = (
+            seen_index if seen_index is not None else SeenArticleIndex(None)
+        )
+        self.chunk_size = chunk_size
+
+    def filter_urls(self, urls: Iterable[str]) -> list[str]:
+        # dict.fromkeys removes duplicates while keeping the order
+        unique_urls = list(dict.fromkeys(urls))
+        candidates = [
+            url for url in unique_urls if article_id(url) not in self.seen_index
+        ]
+
+        logger.debug(
+            f"{len(unique_urls) - len(candidates)} URLs are already known to be stored, looking up the remaining {len(candidates)}"
+        )
+
+        new_urls: set[str] = set()
+
+        for i in range(0, len(candidates), self.chunk_size):
+            new_urls.update(
+                config_options.es_article_client.filter_document_list(
+                    candidates[i : i + self.chunk_size]
+                )
+            )
+
+        self.seen_index.add(
+            article_id(url) for url in candidates if url not in new_urls
+        )
+
+        return [url for url in candidates if url in new_urls]
+
+    # Filters the URLs of all profiles together, with URLs found for more than one profile kept for the first one
+    def filter_collection(
+        self, url_collection: dict[str, list[str]]
+    ) -> dict[str, list[str]]:
+        new_urls = set(
+            self.filter_urls(url for urls in url_collection.values() for url in urls)
+        )
+
+        filtered_collection: dict[str, list[str]] = {}
+
+        for profile_name, urls in url_collection.items():
+            filtered_collection[profile_name] = [
+                url for url in dict.fromkeys(urls) if url in new_urls
+            ]
+            new_urls.difference_update(filtered_collection[profile_name])
+
+        return filtered_collection
+
+    def mark_stored(self, article: FullArticle) -> None:
+        self.seen_index.add([article.id])
+
+    def save(self) -> None:
+        self.seen_index.save()
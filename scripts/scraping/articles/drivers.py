@@ -0,0 +1,219 @@
+import atexit
+from contextlib import contextmanager
+import logging
+import threading
+from typing import Iterator
+from urllib.parse import urlparse
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.firefox.options import Options
+
+from .browser import BrowserConfig, load_browser_config
+from .timing import span
+
+logger = logging.getLogger("osinter")
+
+
+class PooledDriver:
+    def __init__(self, driver: webdriver.Firefox, block_resources: bool) -> None:
+        self.driver = driver
+        self.block_resources = block_resources
+        self.page_count = 0
+        # The domain of the last page rendered by the browser
+        self.domain: str | None = None
+
+    def is_healthy(self) -> bool:
+        try:
+            return self.driver.execute_script("return true") is True
+        except WebDriverException:
+            return False
+
+    # Remove what the previous page left behind for its own site. State left for other sites, like third-party cookies,
+    # IndexedDB and service workers, can't be reached from here, which is why browsers are only reused within a domain
+    def reset(self) -> None:
+        self.driver.execute_script(
+            "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+        )
+        self.driver.delete_all_cookies()
+        self.driver.get("about:blank")
+
+    def quit(self) -> None:
+        try:
+            self.driver.quit()
+        except WebDriverException:
+            logger.debug("Browser instance didn't shut down cleanly", exc_info=True)
+
+
+# Pool of browser instances which are reused across pages, so a scrape run only pays for starting a browser once per worker.
+# Browsers are recycled after having rendered max_pages pages, if they crash, or when needed for a different domain than
+# the one they last rendered, so no state carries over between sites. Browsers blocking unneeded resources and browsers
+# loading everything are kept apart, for the profiles which need the latter
+class DriverPool:
+    def __init__(
+        self,
+        size: int = 1,
+        max_pages: int = 50,
+        headless: bool = True,
+        browser_config: BrowserConfig | None = None,
+    ) -> None:
+        if size < 1:
+            raise ValueError("Driver pool needs room for at least one browser")
+
+        self.size = size
+        self.max_pages = max_pages
+        self.headless = headless
+        self.browser_config = (
+            browser_config if browser_config else load_browser_config()
+        )
+
+        # Most recently returned last
+        self._idle: list[PooledDriver] = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._drivers: set[PooledDriver] = set()
+        self._closed = False
+
+    def __enter__(self) -> "DriverPool":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.close()
+
+    def _start_driver(self, block_resources: bool) -> PooledDriver:
+        # Setting the options for running the browser driver headlessly so it doesn't pop up when running the script
+        driver_options = Options()
+        if self.headless:
+            driver_options.add_argument("-headless")
+
+        if block_resources:
+            for name, value in self.browser_config.preferences().items():
+                driver_options.set_preference(name, value)
+
+        logger.debug("Starting new browser instance for driver pool")
+        with span("browser_start"):
+            pooled = PooledDriver(
+                webdriver.Firefox(options=driver_options), block_resources
+            )
+
+        with self._lock:
+            self._drivers.add(pooled)
+
+        return pooled
+
+    def _discard(self, pooled: PooledDriver) -> None:
+        with self._lock:
+            self._drivers.discard(pooled)
+
+        pooled.quit()
+
+    def _take_idle(self, block_resources: bool, domain: str) -> PooledDriver | None:
+        with self._lock:
+            for pooled in reversed(self._idle):
+                if (
+                    pooled.block_resources == block_resources
+                    and pooled.domain == domain
+                ):
+                    self._idle.remove(pooled)
+                    return pooled
+
+        return None
+
+    # Keeps the number of running browsers within the size of the pool, by making room for a new browser
+    def _make_room(self, domain: str) -> None:
+        with self._lock:
+            if len(self._drivers) < self.size or not self._idle:
+                return
+
+            pooled = self._idle.pop(0)
+
+        logger.debug(
+            f'Recycling browser instance last used for "{pooled.domain}" to render a page from "{domain}"'
+        )
+        self._discard(pooled)
+
+    def _checkout(self, block_resources: bool, domain: str) -> PooledDriver:
+        while True:
+            pooled = self._take_idle(block_resources, domain)
+
+            if pooled is None:
+                self._make_room(domain)
+                return self._start_driver(block_resources)
+
+            if pooled.is_healthy():
+                return pooled
+
+            logger.warning("Discarding unresponsive browser instance from pool")
+            self._discard(pooled)
+
+    def _checkin(self, pooled: PooledDriver) -> None:
+        pooled.page_count += 1
+
+        if self._closed or pooled.page_count >= self.max_pages:
+            logger.debug(f"Recycling browser instance after {pooled.page_count} pages")
+            self._discard(pooled)
+            return
+
+        try:
+            pooled.reset()
+        except WebDriverException:
+            logger.warning("Failed resetting browser instance, discarding it")
+            self._discard(pooled)
+            return
+
+        with self._lock:
+            self._idle.append(pooled)
+
+    @contextmanager
+    def driver(
+        self, url: str, profile_name: str | None = None
+    ) -> Iterator[webdriver.Firefox]:
+        if self._closed:
+            raise RuntimeError("Driver pool has been closed")
+
+        domain = urlparse(url).netloc.lower()
+
+        with self._slots:
+            pooled = self._checkout(
+                self.browser_config.blocks_resources_for(profile_name), domain
+            )
+            pooled.domain = domain
+
+            try:
+                yield pooled.driver
+            except WebDriverException:
+                # The browser might have crashed, so rather start a fresh one for the next page
+                self._discard(pooled)
+                raise
+            except BaseException:
+                self._checkin(pooled)
+                raise
+            else:
+                self._checkin(pooled)
+
+    def close(self) -> None:
+        self._closed = True
+
+        with self._lock:
+            drivers = list(self._drivers)
+            self._drivers.clear()
+            self._idle.clear()
+
+        for pooled in drivers:
+            pooled.quit()
+
+
+_default_pool: DriverPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+# Pool used when the caller doesn't supply one, like when testing single profiles
+def get_default_driver_pool() -> DriverPool:
+    global _default_pool
+
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = DriverPool()
+            atexit.register(_default_pool.close)
+
+        return _default_pool
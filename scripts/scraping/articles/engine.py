@@ -0,0 +1,125 @@
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Callable
+from urllib.parse import urlparse
+
+logger = logging.getLogger("osinter")
+
+
+# Runs scraping tasks for multiple profiles concurrently. Profiles are served round-robin so a site with many articles
+# can't starve the others, while the number of simultaneous requests and the spacing between requests are limited per domain.
+# The number of workers doubles as the global cap on tasks in flight, so tasks are never queued up behind a slow site
+class ScrapeEngine:
+    def __init__(
+        self, workers: int = 4, per_domain: int = 2, domain_delay: float = 1.0
+    ) -> None:
+        if workers < 1 or per_domain < 1:
+            raise ValueError("Scrape engine needs at least one worker per domain")
+
+        self.workers = workers
+        self.per_domain = per_domain
+        self.domain_delay = domain_delay
+
+    def run(
+        self,
+        url_collection: dict[str, list[str]],
+        task: Callable[[str, str], None],
+        stop: threading.Event | None = None,
+    ) -> None:
+        stop = stop if stop else threading.Event()
+
+        pending = {
+            profile_name: deque(urls)
+            for profile_name, urls in url_collection.items()
+            if urls
+        }
+        rotation = deque(pending)
+
+        condition = threading.Condition()
+        active_domains: Counter[str] = Counter()
+        next_allowed: dict[str, float] = {}
+        in_flight = 0
+
+        # Find the next profile in line which has an article on a domain that can be requested right now. Returns
+        # how long to wait for a domain to become available when nothing can be started
+        def pick() -> tuple[str, str, str] | float | None:
+            now = time.monotonic()
+            wait_time: float | None = None
+
+            for _ in range(len(rotation)):
+                profile_name = rotation.popleft()
+                urls = pending[profile_name]
+                domain = urlparse(urls[0]).netloc.lower()
+
+                available_at = next_allowed.get(domain, 0.0)
+
+                if active_domains[domain] < self.per_domain and available_at <= now:
+                    url = urls.popleft()
+                    if urls:
+                        rotation.append(profile_name)
+
+                    return profile_name, url, domain
+
+                rotation.append(profile_name)
+
+                if available_at > now:
+                    delay = available_at - now
+                    wait_time = delay if wait_time is None else min(wait_time, delay)
+
+            return wait_time
+
+        def run_task(profile_name: str, url: str, domain: str) -> None:
+            nonlocal in_flight
+
+            try:
+                task(profile_name, url)
+            except Exception:
+                logger.exception(
+                    f'Unhandled problem with article with URL "{url}" from the "{profile_name}" profile'
+                )
+            finally:
+                with condition:
+                    active_domains[domain] -= 1
+                    in_flight -= 1
+                    condition.notify()
+
+        start_time = time.monotonic()
+        task_count = sum(len(urls) for urls in pending.values())
+
+        with ThreadPoolExecutor(self.workers) as executor, condition:
+            while rotation or in_flight:
+                wait_time: float | None = None
+
+                # Once stopped, no new tasks are started, while the ones in flight are left to finish
+                if stop.is_set() and rotation:
+                    skipped_count = sum(len(pending[name]) for name in rotation)
+                    logger.warning(
+                        f"Scraping was stopped, skipping the remaining {skipped_count} tasks"
+                    )
+                    task_count -= skipped_count
+                    rotation.clear()
+                    continue
+
+                if rotation and in_flight < self.workers:
+                    picked = pick()
+
+                    if isinstance(picked, tuple):
+                        profile_name, url, domain = picked
+
+                        in_flight += 1
+                        active_domains[domain] += 1
+                        next_allowed[domain] = time.monotonic() + self.domain_delay
+
+                        executor.submit(run_task, profile_name, url, domain)
+                        continue
+
+                    wait_time = picked
+
+                condition.wait(wait_time)
+
+        logger.info(
+            f"Finished {task_count} scraping tasks across {len(pending)} profiles in {time.monotonic() - start_time:.1f} seconds"
+        )
@@ -1,20 +1,70 @@
-from typing import Annotated, Pattern
-from dateparser import parse as date_parse
+from collections import defaultdict
+from copy import copy
+from typing import Annotated, Any, cast
 from datetime import datetime, timezone
 import json
-import re
 
 from bs4 import BeautifulSoup, Tag
-from bs4.element import ResultSet
+from bs4.element import NavigableString, PageElement
 from pydantic import AwareDatetime, BaseModel, PastDatetime
 
-from modules.profiles import ArticleContent, ArticleMeta, ElementSelector
+from modules.profiles import ArticleContent, ArticleMeta
 
-# Used for matching the relevant information from LD+JSON
-json_patterns = {
-    "publish_date": re.compile(r'("datePublished": ")(.*?)(?=")'),
-    "author": re.compile(r'("@type": "Person",.*?"name": ")(.*?)(?=")'),
-}
+from .dates import date_parser
+from .selector_plans import MetaSelector, content_plan, meta_plan
+
+
+# Index over the LD+JSON data of a page, with every object in it listed by its type and every value listed by its key, in
+# the order they appear. Sites place the information in very different spots, with some nesting it in "@graph" arrays,
+# some in lists of objects and some directly in the top object, so the whole graph is walked instead of looking in
+# fixed places
+class LinkedDataIndex:
+    def __init__(self) -> None:
+        self.objects_by_type: defaultdict[str, list[dict[str, Any]]] = defaultdict(list)
+        self.values_by_key: defaultdict[str, list[Any]] = defaultdict(list)
+
+    @classmethod
+    def from_soup(cls, soup: BeautifulSoup) -> "LinkedDataIndex":
+        index = cls()
+
+        for script_tag in soup.find_all("script", {"type": "application/ld+json"}):
+            try:
+                index.add(json.loads("".join(script_tag.contents)))
+            except json.decoder.JSONDecodeError:
+                continue
+
+        return index
+
+    def add(self, data: Any) -> None:
+        if isinstance(data, list):
+            for item in data:
+                self.add(item)
+        elif isinstance(data, dict):
+            object_types = data.get("@type", [])
+
+            for object_type in (
+                object_types if isinstance(object_types, list) else [object_types]
+            ):
+                if isinstance(object_type, str):
+                    self.objects_by_type[object_type].append(data)
+
+            for key, value in data.items():
+                self.values_by_key[key].append(value)
+                self.add(value)
+
+    def first_string(self, key: str) -> str | None:
+        for value in self.values_by_key.get(key, []):
+            if isinstance(value, str):
+                return value
+
+        return None
+
+    def person_names(self) -> list[str]:
+        return [
+            person["name"]
+            for person in self.objects_by_type.get("Person", [])
+            if isinstance(person.get("name"), str)
+        ]
 
 
 class OGTags(BaseModel):
@@ -25,102 +75,144 @@ class OGTags(BaseModel):
     publish_date: Annotated[datetime, AwareDatetime, PastDatetime]
 
 
+# Whitespace is stripped from strings being the only content of these tags
+text_tag_types = frozenset(["p", "span"] + [f"h{i}" for i in range(1, 7)])
+
+
+def locate_article_containers(
+    selectors: ArticleContent, soup: BeautifulSoup
+) -> list[Tag]:
+    plan = content_plan(selectors)
+
+    # Clean the textlist for unwanted html elements
+    plan.remove_unwanted(soup)
+
+    if plan.container is None:
+        raise Exception(
+            "Wasn't able to fetch the text for the following soup:" + str(soup)
+        )
+
+    return plan.container.select(soup)
+
+
+# Whether the string is the only content of a text tag inside the container, either directly or through elements
+# containing nothing else, which is what Tag.string returns for that tag
+def is_lone_text_tag_string(string: NavigableString, container: Tag) -> bool:
+    node: PageElement = string
+
+    while (
+        (parent := node.parent) is not None
+        and parent is not container
+        and len(parent.contents) == 1
+    ):
+        if parent.name in text_tag_types:
+            return True
+
+        node = parent
+
+    return False
+
+
+# Strips the whitespace around the strings of text tags and collects the text of the container in the same walk over
+# the tree, instead of searching it for every text tag and then walking it again for the text
+def clean_container_text(container: Tag) -> str:
+    string_types = container.interesting_string_types
+    text: list[str] = []
+
+    # The descendants are listed up front, as replacing a string while walking them would end the walk
+    for node in list(container.descendants):
+        if not isinstance(node, NavigableString):
+            continue
+
+        if is_lone_text_tag_string(node, container) and node != node.strip():
+            parent = cast(Tag, node.parent)
+            node.replace_with(node.strip())
+            node = cast(NavigableString, parent.contents[0])
+
+        if string_types is None or type(node) in string_types:
+            text.append(node)
+
+    return "".join(text)
+
+
 def extract_article_content(
     selectors: ArticleContent, soup: BeautifulSoup, delimiter: str = "\n"
 ) -> tuple[str, str]:
-    def locate_content(css_selector: str, soup: BeautifulSoup) -> ResultSet[Tag] | None:
-        try:
-            return soup.select(css_selector)
-        except:
-            return None
+    assembled_text: list[str] = []
+    assembled_clear_text: list[str] = []
 
-    def clean_soup(
-        soup: BeautifulSoup, profile_remove_selectors: list[str]
-    ) -> BeautifulSoup:
-        remove_selectors = ["style", "script"]
-        remove_selectors.extend(profile_remove_selectors)
+    for container in locate_article_containers(selectors, soup):
+        assembled_clear_text.extend((clean_container_text(container), delimiter))
+        assembled_text.extend((str(container), delimiter))
 
-        for css_selector in remove_selectors:
-            for tag in soup.select(css_selector):
-                tag.decompose()
+    return "".join(assembled_text), "".join(assembled_clear_text)
 
-        return soup
 
-    # Clean the textlist for unwanted html elements
-    soup = clean_soup(soup, selectors.remove)
+# Like extract_article_content, but with the content moved into a soup of its own instead of written out as HTML, so it
+# can be handed straight to the markdown converter without being written out and parsed again
+def extract_article_fragment(
+    selectors: ArticleContent, soup: BeautifulSoup, delimiter: str = "\n"
+) -> tuple[BeautifulSoup, str]:
+    containers = locate_article_containers(selectors, soup)
+    assembled_clear_text: list[str] = []
 
-    text_list = locate_content(selectors.container, soup)
+    for container in containers:
+        assembled_clear_text.extend((clean_container_text(container), delimiter))
 
-    if text_list is None:
-        raise Exception(
-            "Wasn't able to fetch the text for the following soup:" + str(soup)
-        )
+    # Containers inside other containers are copied rather than moved, so they are still part of the outer ones
+    container_ids = {id(container) for container in containers}
+    nested = [
+        any(id(parent) in container_ids for parent in container.parents)
+        for container in containers
+    ]
 
-    assembled_text = ""
-    assembled_clear_text = ""
-    text_tag_types = ["p", "span"] + [f"h{i}" for i in range(1, 7)]
+    fragment = BeautifulSoup("", "html.parser")
 
-    for text_soup in text_list:
-        for text_tag in text_soup.find_all(text_tag_types):
-            if text_tag.string:
-                text_tag.string.replace_with(text_tag.string.strip())
+    for container, is_nested in zip(containers, nested):
+        fragment.append(copy(container) if is_nested else container)
+        fragment.append(delimiter)
 
-        assembled_clear_text = assembled_clear_text + text_soup.get_text() + delimiter
-        assembled_text = assembled_text + str(text_soup) + delimiter
+    # Removing elements leaves the strings around them next to each other, which would have been read back as a
+    # single string if written out and parsed again
+    fragment.smooth()
 
-    return assembled_text, assembled_clear_text
+    return fragment, "".join(assembled_clear_text)
 
 
-# Function for scraping meta information (like title, author and publish date) from articles. This both utilizes the OG tags and LD+JSON data, and while the proccess for extracting the OG tags is fairly simply as those is (nearly) always following the same standard, the LD+JSON data is a little more complicated. Here the data isn't parsed as JSON, but rather as a string where the relevant pieces of information is extracted using regex. It's probably ugly and definitly not the officially "right" way of doing this, but different placement of the information in the JSON object on different websites using different attributes made parsing the information from a python JSON object near impossible. As such, be warned that this function is not for the faint of heart
+# Function for scraping meta information (like title, author and publish date) from articles. This both utilizes the OG tags and LD+JSON data, where the LD+JSON data is used for the information some sites only have there, like author and publish date
 def extract_meta_information(
-    page_soup: BeautifulSoup, scraping_targets: ArticleMeta, site_url: str
+    page_soup: BeautifulSoup,
+    scraping_targets: ArticleMeta,
+    site_url: str,
+    profile_name: str | None = None,
 ) -> OGTags:
-    def extract_with_selector(selector: str | ElementSelector) -> None | str:
-        # Skip empty selectors, as some profiles rely on LD+JSON for some fields and therefore doesn't have CSS selectors for author and date
-        if not selector:
-            return None
-
-        try:
-            if isinstance(selector, str):
-                tag = page_soup.select(selector)[0]
-                return tag.text
-            elif isinstance(selector, ElementSelector):
-                tag = page_soup.select(selector.element)[0]
-                contents = tag.get(selector.content_field)
-
-                if isinstance(contents, str):
-                    return contents
-                else:
-                    return None
-        except IndexError:
-            return None
-
-    # Use ld+json to extract extra information not found in the meta OG tags like author and publish date
-    def extract_json(pattern: Pattern[str]) -> str | None:
-        json_script_tags = page_soup.find_all("script", {"type": "application/ld+json"})
-
-        for script_tag in json_script_tags:
-            # Converting to and from JSON to standardize the format to avoid things like line breaks and excesive spaces at the end and start of line. Will also make sure there spaces in the right places between the keys and values so it isn't like "key" :"value" and "key  : "value" but rather "key": "value" and "key": "value".
-            try:
-                script_tag_string = json.dumps(json.loads("".join(script_tag.contents)))
-            except json.decoder.JSONDecodeError:
-                continue
+    plan = meta_plan(scraping_targets)
+    linked_data: LinkedDataIndex | None = None
 
-            detail_match = pattern.search(script_tag_string)
+    def extract_with_selector(selector: MetaSelector | None) -> None | str:
+        return selector.extract(page_soup) if selector else None
 
-            if detail_match:
-                return detail_match.group(2)
+    # The LD+JSON data is only parsed when needed, and then only once for all the fields using it
+    def get_linked_data() -> LinkedDataIndex:
+        nonlocal linked_data
 
-        return None
+        if linked_data is None:
+            linked_data = LinkedDataIndex.from_soup(page_soup)
+
+        return linked_data
+
+    def extract_json_author() -> str | None:
+        names = get_linked_data().person_names()
+        return names[0] if names else None
 
     def extract_datetime() -> datetime | None:
-        meta = extract_with_selector(scraping_targets.publish_date)
+        meta = extract_with_selector(plan.publish_date)
         if meta:
-            return date_parse(meta)
+            return date_parser.parse(meta, profile_name)
 
-        json = extract_json(json_patterns["publish_date"])
+        json = get_linked_data().first_string("datePublished")
         if json:
-            return date_parse(json)
+            return date_parser.parse(json, profile_name)
 
         return None
 
@@ -129,11 +221,9 @@ def extract_meta_information(
     if publish_date.tzinfo is None:
         publish_date = publish_date.replace(tzinfo=timezone.utc)
 
-    title = extract_with_selector(scraping_targets.title)
-    description = extract_with_selector(scraping_targets.description)
-    author = extract_with_selector(scraping_targets.author) or extract_json(
-        json_patterns["author"]
-    )
+    title = extract_with_selector(plan.title)
+    description = extract_with_selector(plan.description)
+    author = extract_with_selector(plan.author) or extract_json_author()
     author = author.strip() if author else author
 
     if not title or not description:
@@ -142,8 +232,7 @@ def extract_meta_information(
     return OGTags(
         title=title,
         description=description,
-        image_url=extract_with_selector(scraping_targets.image_url)
-        or f"{site_url}/favicon.ico",
+        image_url=extract_with_selector(plan.image_url) or f"{site_url}/favicon.ico",
         author=author,
         publish_date=publish_date,
     )
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import threading
+from typing import Literal, NamedTuple
+
+from bs4 import BeautifulSoup
+from modules.misc import create_folder
+from modules.profiles import Profile
+
+from .drivers import DriverPool
+from .parsing import parse_html
+from .scraping import scrape_page_dynamic, scrape_web_page
+from .selector_plans import content_plan, meta_plan
+from .waiting import get_wait_settings
+
+logger = logging.getLogger("osinter")
+
+FetchStrategy = Literal["static", "dynamic", "auto"]
+fetch_strategies: tuple[FetchStrategy, ...] = ("static", "dynamic", "auto")
+
+
+# Remembers which way of fetching articles works for each profile, so later runs can skip straight to the cheapest working one.
+# Profiles without an entry, or with "auto" written in the file, will be probed again
+class FetchStrategyStore:
+    def __init__(self, path: str | None = "./cache/fetch_strategies.json") -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._strategies: dict[str, FetchStrategy] = {}
+        # Profiles whose static pages don't match, where the browser didn't do any better either. Their static pages
+        # are used without checking them for the rest of the run, instead of trying the browser for every article
+        self._unchecked: set[str] = set()
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                stored: dict[str, str] = json.load(f)
+
+            self._strategies = {
+                profile_name: strategy
+                for profile_name, strategy in stored.items()
+                if strategy in fetch_strategies
+            }
+
+    def get(self, profile_name: str) -> FetchStrategy:
+        with self._lock:
+            return self._strategies.get(profile_name, "auto")
+
+    def remember(
+        self, profile_name: str, strategy: Literal["static", "dynamic"]
+    ) -> None:
+        with self._lock:
+            if self._strategies.get(profile_name) != strategy:
+                logger.info(
+                    f'Using {strategy} fetching for the "{profile_name}" profile from now on'
+                )
+            self._strategies[profile_name] = strategy
+
+    # Settles on a strategy once a static page hasn't matched the profile, depending on whether the browser did better
+    def settle(self, profile_name: str, browser_matched: bool) -> None:
+        if browser_matched:
+            self.remember(profile_name, "dynamic")
+            return
+
+        with self._lock:
+            if profile_name not in self._unchecked:
+                logger.info(
+                    f'Pages from the "{profile_name}" profile don\'t match it when using the browser either, using them without checking'
+                )
+            self._unchecked.add(profile_name)
+
+        self.remember(profile_name, "static")
+
+    def checks_static_pages(self, profile_name: str) -> bool:
+        with self._lock:
+            return profile_name not in self._unchecked
+
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            create_folder(folder, change_mode=False)
+
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump(self._strategies, f, indent=4, sort_keys=True)
+
+
+# Check whether a statically fetched page contains what the profile needs, as a page missing it probably relies on JS for rendering
+def page_matches_profile(soup: BeautifulSoup, profile: Profile) -> bool:
+    content = content_plan(profile.scraping.content)
+    meta = meta_plan(profile.scraping.meta)
+
+    if content.container is None or content.container.select_one(soup) is None:
+        return False
+
+    return all(
+        selector.selector.select_one(soup) is not None
+        for selector in [meta.title, meta.description]
+        if selector
+    )
+
+
+# Raised for a statically fetched page which turns out not to match the profile, as the browser might do better
+class PageMismatchError(Exception):
+    pass
+
+
+class FetchedPage(NamedTuple):
+    source: str | bytes
+    strategy: Literal["static", "dynamic"]
+    # Set when the page had to be parsed while fetching it, so it doesn't have to be parsed again
+    soup: BeautifulSoup | None
+    # Static pages not parsed while fetching them, which whoever parses them has to check against the profile
+    unverified: bool = False
+
+
+# Fetch an article page, trying the cheap static fetch before the browser unless the profile is known to need it.
+# With verify_static disabled, static pages are passed on without being parsed, leaving it to whoever parses them to
+# check that they match the profile, and to fetch them again using the browser if they don't
+def fetch_article_page(
+    url: str,
+    profile: Profile,
+    strategy_store: FetchStrategyStore | None = None,
+    driver_pool: DriverPool | None = None,
+    verify_static: bool = True,
+) -> FetchedPage:
+    profile_name = profile.source.profile_name
+    strategy_store = strategy_store if strategy_store else FetchStrategyStore(None)
+
+    # JS injections can only be run in the browser
+    if profile.scraping.js_injections:
+        strategy: FetchStrategy = "dynamic"
+    else:
+        strategy = strategy_store.get(profile_name)
+
+    # Set when a static page arrived without what the profile needs, as opposed to the fetch failing. A failed fetch
+    # can be down to a timeout or rate limiting, so it only sends this page to the browser, without changing strategy
+    static_mismatch = False
+
+    if strategy != "dynamic":
+        try:
+            page = scrape_web_page(url)
+        except Exception:
+            logger.debug(f'Static fetch failed for "{url}"', exc_info=True)
+            page = None
+
+        if page is None:
+            logger.debug(
+                f'Static fetch of "{url}" failed, using the browser for this page'
+            )
+        else:
+            check = strategy_store.checks_static_pages(profile_name)
+
+            if not verify_static or not check:
+                return FetchedPage(page, "static", None, check)
+
+            soup = parse_html(page)
+
+            if page_matches_profile(soup, profile):
+                strategy_store.remember(profile_name, "static")
+                return FetchedPage(page, "static", soup)
+
+            static_mismatch = True
+            logger.debug(
+                f'Static fetch of "{url}" didn\'t match the "{profile_name}" profile, falling back to the browser'
+            )
+
+    page_source = fetch_dynamic_page(url, profile, driver_pool)
+    # Pages are only parsed here when deciding whether to give up on static fetching, otherwise they are left for whoever
+    # parses them, so they are only parsed once
+    if not static_mismatch:
+        return FetchedPage(page_source, "dynamic", None)
+
+    soup = parse_html(page_source)
+
+    # Only give up on static fetching if the browser actually does better
+    strategy_store.settle(profile_name, page_matches_profile(soup, profile))
+
+    return FetchedPage(page_source, "dynamic", soup)
+
+
+def fetch_dynamic_page(
+    url: str, profile: Profile, driver_pool: DriverPool | None = None
+) -> str:
+    return scrape_page_dynamic(
+        url,
+        profile.scraping.js_injections,
+        driver_pool=driver_pool,
+        wait_settings=get_wait_settings(profile.source.profile_name),
+        content_selector=profile.scraping.content.container,
+        profile_name=profile.source.profile_name,
+    )
+
+
+def fetch_article_soup(
+    url: str,
+    profile: Profile,
+    strategy_store: FetchStrategyStore | None = None,
+    driver_pool: DriverPool | None = None,
+) -> BeautifulSoup:
+    page = fetch_article_page(url, profile, strategy_store, driver_pool)
+    if page.soup is not None:
+        return page.soup
+
+    return parse_html(page.source)
@@ -0,0 +1,38 @@
+from functools import cache
+import logging
+import os
+
+from bs4 import BeautifulSoup, FeatureNotFound
+
+logger = logging.getLogger("osinter")
+
+# Every backend builds a regular BeautifulSoup tree, so the CSS selectors from the profiles work the same regardless of
+# which one is used. lxml is several times faster than the pure Python parser, which is kept as a fallback
+parser_backends = ("lxml", "html.parser", "html5lib")
+default_parser_backend = "lxml"
+
+
+# The backend can be chosen per deployment with the HTML_PARSER environment variable
+@cache
+def get_parser_backend() -> str:
+    backend = os.environ.get("HTML_PARSER", default_parser_backend)
+
+    if backend not in parser_backends:
+        logger.warning(
+            f'Unknown HTML parser "{backend}", using "{default_parser_backend}" instead'
+        )
+        backend = default_parser_backend
+
+    try:
+        BeautifulSoup("", backend)
+    except FeatureNotFound:
+        logger.warning(
+            f'HTML parser "{backend}" isn\'t installed, falling back to "html.parser"'
+        )
+        backend = "html.parser"
+
+    return backend
+
+
+def parse_html(source: str | bytes, backend: str | None = None) -> BeautifulSoup:
+    return BeautifulSoup(source, backend if backend else get_parser_backend())
@@ -0,0 +1,141 @@
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Generic, TypeVar
+
+from .engine import ScrapeEngine
+
+logger = logging.getLogger("osinter")
+
+Page = TypeVar("Page")
+Article = TypeVar("Article")
+
+
+# Splits scraping into three stages running at the same time: fetching pages in the engine's threads, parsing them in
+# a pool of processes and storing the results in a single indexing thread. The stages are connected by a bounded
+# number of slots, so fetching pauses when parsing or indexing falls behind, instead of piling up pages in memory.
+# Pages failing in a way the retry callback accepts are fetched again, in another round once the current one is done
+class ScrapePipeline(Generic[Page, Article]):
+    def __init__(
+        self,
+        engine: ScrapeEngine | None = None,
+        parse_workers: int | None = None,
+        queue_size: int | None = None,
+    ) -> None:
+        self.engine = engine if engine else ScrapeEngine()
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size or self.parse_workers * 2
+
+        self._executor: ProcessPoolExecutor | None = None
+
+    # Forking while other threads are running can leave their locks held in the children, so the parsing processes are
+    # all started when entering the pipeline, which has to be done before starting any threads, like the bulk writer's
+    def __enter__(self) -> "ScrapePipeline[Page, Article]":
+        self._executor = ProcessPoolExecutor(self.parse_workers)
+        self._executor.submit(int).result()
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        if self._executor:
+            self._executor.shutdown()
+            self._executor = None
+
+    def run(
+        self,
+        url_collection: dict[str, list[str]],
+        fetch: Callable[[str, str], Page],
+        parse: Callable[[Page], Article],
+        store: Callable[[Page, Article], None],
+        on_error: Callable[[Page, Exception], None],
+        retry: Callable[[Page, Exception], bool] | None = None,
+    ) -> None:
+        if self._executor is None:
+            with self:
+                return self.run(url_collection, fetch, parse, store, on_error, retry)
+
+        executor = self._executor
+        slots = threading.BoundedSemaphore(self.queue_size)
+        stop = threading.Event()
+        broken_pool: list[BrokenProcessPool] = []
+        parsing: queue.Queue[tuple[str, str, Page, Future[Article]] | None] = (
+            queue.Queue()
+        )
+
+        # Each URL is only retried once, so a page failing the same way again is reported instead of retried forever
+        retried: set[tuple[str, str]] = set()
+        retries: defaultdict[str, list[str]] = defaultdict(list)
+
+        # A parsing process dying takes the whole pool down with it, so every remaining article would fail
+        def stop_on_broken_pool(e: Exception) -> None:
+            if isinstance(e, BrokenProcessPool) and not stop.is_set():
+                logger.error(
+                    "A parsing process died unexpectedly, stopping the scrape run"
+                )
+                broken_pool.append(e)
+                stop.set()
+
+        # Results are handled in the order the pages were fetched, while the pool keeps parsing the ones behind them
+        def index_stage() -> None:
+            while (item := parsing.get()) is not None:
+                profile_name, url, page, future = item
+
+                try:
+                    store(page, future.result())
+                except Exception as e:
+                    stop_on_broken_pool(e)
+
+                    if retry and (profile_name, url) not in retried and retry(page, e):
+                        retried.add((profile_name, url))
+                        retries[profile_name].append(url)
+                    else:
+                        on_error(page, e)
+                finally:
+                    slots.release()
+                    parsing.task_done()
+
+        indexer = threading.Thread(target=index_stage)
+        indexer.start()
+
+        def fetch_stage(profile_name: str, url: str) -> None:
+            page = fetch(profile_name, url)
+
+            slots.acquire()
+
+            try:
+                future = executor.submit(parse, page)
+            except BrokenProcessPool as e:
+                slots.release()
+                stop_on_broken_pool(e)
+                on_error(page, e)
+                return
+            except BaseException:
+                slots.release()
+                raise
+
+            parsing.put((profile_name, url, page, future))
+
+        try:
+            round_collection = url_collection
+
+            while round_collection and not stop.is_set():
+                self.engine.run(round_collection, fetch_stage, stop)
+
+                # Retries are only known once every page of the round has been parsed
+                parsing.join()
+                round_collection = dict(retries)
+                retries.clear()
+
+                if round_collection:
+                    logger.info(
+                        f"Retrying {sum(len(urls) for urls in round_collection.values())} articles"
+                    )
+        finally:
+            parsing.put(None)
+            indexer.join()
+
+        if broken_pool:
+            raise broken_pool[0]
@@ -0,0 +1,211 @@
+import asyncio
+from collections import defaultdict
+import json
+import logging
+import os
+import threading
+from types import TracebackType
+from typing import Callable, TypedDict
+
+import httpx
+from modules.misc import create_folder
+
+from .scraping import get_request_headers
+
+logger = logging.getLogger("osinter")
+
+retryable_status_codes = {429, 500, 502, 503, 504}
+
+
+class ValidatorEntry(TypedDict):
+    etag: str | None
+    last_modified: str | None
+    max_url_count: int
+    links: list[str]
+
+
+# On-disk cache of the ETag and Last-Modified validators for front pages and RSS feeds, along with the article links
+# extracted from them, so pages which haven't changed since the last run can be answered with a 304 and skipped
+class ValidatorCache:
+    def __init__(self, path: str | None = "./cache/http_validators.json") -> None:
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: dict[str, ValidatorEntry] = {}
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+
+    def request_headers(self, url: str, max_url_count: int) -> dict[str, str]:
+        with self._lock:
+            entry = self._entries.get(url)
+
+        # Links extracted with a different limit can't be reused
+        if not entry or entry["max_url_count"] != max_url_count:
+            return {}
+
+        headers: dict[str, str] = {}
+
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def cached_links(self, url: str) -> list[str]:
+        with self._lock:
+            self.hits += 1
+            return list(self._entries[url]["links"])
+
+    def store(
+        self,
+        url: str,
+        response: httpx.Response,
+        max_url_count: int,
+        links: list[str],
+    ) -> None:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        with self._lock:
+            self.misses += 1
+
+            if etag or last_modified:
+                self._entries[url] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "max_url_count": max_url_count,
+                    "links": links,
+                }
+            else:
+                self._entries.pop(url, None)
+
+    def save(self) -> None:
+        if not self.path:
+            return
+
+        folder = os.path.dirname(self.path)
+        if folder:
+            create_folder(folder, change_mode=False)
+
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump(self._entries, f)
+
+
+# Asynchronous HTTP client for retrieving front pages and RSS feeds. Connections are kept alive and reused across
+# requests to the same host, and HTTP/2 is used where the server supports it, so all profiles can be gathered in parallel
+class AsyncFetcher:
+    def __init__(
+        self,
+        timeout: float = 15.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        per_host: int = 4,
+        http2: bool = True,
+        validator_cache: ValidatorCache | None = None,
+    ) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.validator_cache = validator_cache
+
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(timeout),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            follow_redirects=True,
+        )
+        self._host_limits: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(per_host)
+        )
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    # Retry connection problems and temporary server errors with exponential backoff
+    async def _request(
+        self, url: str, extra_headers: dict[str, str] | None = None
+    ) -> httpx.Response:
+        attempt = 0
+
+        while True:
+            try:
+                response = await self._client.get(
+                    url, headers=get_request_headers() | (extra_headers or {})
+                )
+
+                if (
+                    response.status_code not in retryable_status_codes
+                    or attempt >= self.retries
+                ):
+                    return response
+
+                logger.debug(
+                    f'Got status code {response.status_code} from "{url}", retrying'
+                )
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+
+                logger.debug(f'Request to "{url}" failed, retrying', exc_info=True)
+
+            await asyncio.sleep(self.backoff * 2**attempt)
+            attempt += 1
+
+    async def _get(
+        self, url: str, extra_headers: dict[str, str] | None = None
+    ) -> httpx.Response:
+        async with self._host_limits[httpx.URL(url).host]:
+            return await self._request(url, extra_headers)
+
+    async def fetch(self, url: str) -> bytes | None:
+        response = await self._get(url)
+
+        if response.status_code != 200:
+            logger.error(f"Status code {response.status_code}, skipping URL {url}")
+            return None
+
+        return response.content
+
+    # Fetch a page and extract article links from it, skipping both the download and the extraction if the validator
+    # cache shows that the page hasn't changed since last time
+    async def fetch_links(
+        self,
+        url: str,
+        max_url_count: int,
+        extract_links: Callable[[bytes], list[str]],
+    ) -> list[str] | None:
+        cache = self.validator_cache
+        conditional_headers = cache.request_headers(url, max_url_count) if cache else {}
+
+        response = await self._get(url, conditional_headers)
+
+        if cache and conditional_headers and response.status_code == 304:
+            logger.debug(f'"{url}" hasn\'t changed since last run, using cached links')
+            return cache.cached_links(url)
+
+        if response.status_code != 200:
+            logger.error(f"Status code {response.status_code}, skipping URL {url}")
+            return None
+
+        links = extract_links(response.content)
+
+        if cache:
+            cache.store(url, response, max_url_count, links)
+
+        return links
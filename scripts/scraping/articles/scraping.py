@@ -1,6 +1,6 @@
 import logging
 import os
-import time
+import threading
 import re
 from typing import Any, cast
 
@@ -9,11 +9,15 @@ from fake_useragent import UserAgent
 from bs4 import BeautifulSoup, element
 import feedparser  # type: ignore
 import requests
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
 
 from modules.profiles import Profile
 
+from .drivers import DriverPool, get_default_driver_pool
+from .parsing import parse_html
+from .selector_plans import link_plan
+from .timing import span
+from .waiting import WaitSettings, wait_for_injection, wait_for_page
+
 logger = logging.getLogger("osinter")
 
 
@@ -32,24 +36,57 @@ def cat_url(root_url: str, relative_path: str) -> str:
         return root_url[:-1] + relative_path
 
 
-# Simple function for scraping static page and converting it to a soup
-def scrape_web_soup(url: str) -> BeautifulSoup | None:
-    ua = UserAgent(os="Windows", platforms="desktop", min_version=120.0)
-    headers = {
-        "User-Agent": ua.random,
+user_agents = UserAgent(os="Windows", platforms="desktop", min_version=120.0)
+
+# Each thread keeps its own session, so connections are reused between requests without sharing a session across threads
+_local = threading.local()
+
+
+def get_request_headers() -> dict[str, str]:
+    return {
+        "User-Agent": user_agents.random,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
         "Accept-Language": "en-US,en;q=0.5",
         "Referer": "https://www.google.com/",
-        "Connection": "keep-alive",
     }
 
-    page_source: requests.models.Response = requests.get(url, headers=headers)
+
+def get_session() -> requests.Session:
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+
+    return cast(requests.Session, _local.session)
+
+
+# Same as for the asynchronous fetcher, so a site that stops responding can't hold up a worker indefinitely
+request_timeout = 15.0
+
+
+# Simple function for downloading the source of a static page
+def scrape_web_page(url: str) -> bytes | None:
+    try:
+        page_source: requests.models.Response = get_session().get(
+            url, headers=get_request_headers(), timeout=request_timeout
+        )
+    except requests.Timeout:
+        logger.error(f"Timed out after {request_timeout} seconds, skipping URL {url}")
+        return None
 
     if page_source.status_code != 200:
         logger.error(f"Status code {page_source.status_code}, skipping URL {url}")
         return None
 
-    return BeautifulSoup(page_source.content, "html.parser")
+    return page_source.content
+
+
+# Simple function for scraping static page and converting it to a soup
+def scrape_web_soup(url: str) -> BeautifulSoup | None:
+    page_source = scrape_web_page(url)
+
+    if page_source is None:
+        return None
+
+    return parse_html(page_source)
 
 
 def scrape_article_urls(
@@ -58,35 +95,15 @@ def scrape_article_urls(
     web_soups: list[BeautifulSoup] | None = None,
     news_paths: list[str] | None = None,
 ) -> list[str]:
-    def extract_links(soup: BeautifulSoup) -> list[str]:
-        # Getting a soup for the website
-        if profile.source.scraping_targets.container_list:
-            outer_container = soup.select_one(
-                profile.source.scraping_targets.container_list
-            )
-            if (outer_container) is None:
-                raise Exception(
-                    f"Error when scraping the specific container on front-page from {profile.source.profile_name}"
-                )
-        else:
-            outer_container = soup
-
-        inner_containers: list[element.Tag] = outer_container.select(
-            profile.source.scraping_targets.link_containers
-        )
-
-        link_elements: list[element.Tag] = []
+    plan = link_plan(profile)
 
-        if not profile.source.scraping_targets.links:
-            link_elements = inner_containers
-        else:
-            for container in inner_containers:
-                link_element = container.select_one(
-                    profile.source.scraping_targets.links
-                )
+    def extract_links(soup: BeautifulSoup) -> list[str]:
+        link_elements = plan.link_elements(soup, max_url_count)
 
-                if link_element:
-                    link_elements.append(link_element)
+        if link_elements is None:
+            raise Exception(
+                f"Error when scraping the specific container on front-page from {profile.source.profile_name}"
+            )
 
         raw_article_urls: list[str] = [
             url
@@ -113,52 +130,60 @@ def scrape_article_urls(
     return list({item for sublist in links for item in sublist})
 
 
-# Function for scraping a list of recent articles using the url to a RSS feed
+# Function for extracting a list of recent articles from the contents of RSS feeds
 def get_article_urls_from_rss(
-    rss_urls: list[str],
+    rss_feeds: list[bytes],
     max_url_count: int,
 ) -> list[str]:
-    def parse_feed(url: str) -> list[Any]:
+    def parse_feed(feed: bytes) -> list[Any]:
         # Parse the whole RSS feed
-        rss_feed = feedparser.parse(url)
+        rss_feed = feedparser.parse(feed)
         return [entry.id for entry in rss_feed.entries[:max_url_count]]
 
-    links = [parse_feed(url) for url in rss_urls]
+    links = [parse_feed(feed) for feed in rss_feeds]
     return [item for sublist in links for item in sublist]
 
 
 def scrape_page_dynamic(
     page_url: str,
     js_injections: list[str] | None,
-    load_time: int = 3,
-    headless: bool = True,
+    driver_pool: DriverPool | None = None,
+    wait_settings: WaitSettings | None = None,
+    content_selector: str | None = None,
+    profile_name: str | None = None,
 ) -> str:
-    # Setting the options for running the browser driver headlessly so it doesn't pop up when running the script
-    driver_options = Options()
-    if headless:
-        driver_options.add_argument("-headless")
-
-    # Setup the webdriver with options
-    with webdriver.Firefox(
-        options=driver_options,
-    ) as driver:
-        # Actually scraping the page
-        driver.get(page_url)
+    driver_pool = driver_pool if driver_pool else get_default_driver_pool()
+    wait_settings = wait_settings if wait_settings else WaitSettings()
 
-        # Sleeping a pre-specified time to let the driver actually render the page properly
-        time.sleep(load_time)
+    # Borrow a running browser from the pool instead of starting a new one for every page
+    with driver_pool.driver(page_url, profile_name) as driver:
+        # Actually scraping the page
+        with span("page_load", profile_name, page_url):
+            driver.get(page_url)
+
+        # Letting the driver actually render the page properly, for as long as it needs. Injections can be what reveals
+        # the content, like by getting past consent walls, so the content is only waited for once they have run
+        with span("load_wait", profile_name, page_url):
+            wait_for_page(
+                driver, wait_settings, None if js_injections else content_selector
+            )
 
         if js_injections:
-            for injection_name in js_injections:
-                with open(
-                    os.path.normcase(f"./profiles/js_injections/{injection_name}.js")
-                ) as f:
-                    js_script: str = f.read()
-
-                driver.execute_script(js_script)
-
-                while driver.execute_script("return document.osinterReady") == False:
-                    time.sleep(1)
+            with span("js_injections", profile_name, page_url):
+                for injection_name in js_injections:
+                    with open(
+                        os.path.normcase(
+                            f"./profiles/js_injections/{injection_name}.js"
+                        )
+                    ) as f:
+                        js_script: str = f.read()
+
+                    driver.execute_script(js_script)
+                    wait_for_injection(driver, wait_settings, injection_name)
+
+            if content_selector:
+                with span("content_wait", profile_name, page_url):
+                    wait_for_page(driver, wait_settings, content_selector)
 
         # Getting the source code for the page
         return cast(str, driver.page_source)
@@ -0,0 +1,161 @@
+from functools import cache
+from typing import NamedTuple
+
+from bs4 import BeautifulSoup, Tag
+import soupsieve
+from soupsieve import SoupSieve
+
+from modules.profiles import ArticleContent, ArticleMeta, ElementSelector, Profile
+
+# Always removed from the article content, on top of what the profile removes
+default_remove_selectors = ("style", "script")
+
+# Selectors are stored as plain strings or as (element selector, attribute) pairs, so they can be used as cache keys
+SelectorKey = str | tuple[str, str] | None
+
+
+# Profiles use the same handful of selectors for every page, so each selector is only parsed once per process
+@cache
+def compile_selector(selector: str) -> SoupSieve:
+    return soupsieve.compile(selector)
+
+
+class MetaSelector(NamedTuple):
+    selector: SoupSieve
+    # The attribute holding the value, or None for using the text of the element
+    content_field: str | None
+
+    def extract(self, soup: BeautifulSoup) -> str | None:
+        tag = self.selector.select_one(soup)
+
+        if tag is None:
+            return None
+
+        if self.content_field is None:
+            return tag.text
+
+        contents = tag.get(self.content_field)
+        return contents if isinstance(contents, str) else None
+
+
+class ContentPlan(NamedTuple):
+    # None when the container selector isn't valid
+    container: SoupSieve | None
+    # Everything to remove, combined into a single selector so the tree is only searched once
+    remove: SoupSieve
+
+    def remove_unwanted(self, soup: BeautifulSoup) -> None:
+        for tag in self.remove.select(soup):
+            # Matches inside an element which has already been removed are gone along with it
+            if not tag.decomposed:
+                tag.decompose()
+
+
+class MetaPlan(NamedTuple):
+    title: MetaSelector | None
+    description: MetaSelector | None
+    author: MetaSelector | None
+    publish_date: MetaSelector | None
+    image_url: MetaSelector | None
+
+
+class LinkPlan(NamedTuple):
+    container_list: SoupSieve | None
+    link_containers: SoupSieve
+    links: SoupSieve | None
+
+    # Stops searching once limit links have been found, as large front pages can have far more links than are used
+    def link_elements(self, soup: BeautifulSoup, limit: int = 0) -> list[Tag] | None:
+        outer_container: Tag = soup
+
+        if self.container_list:
+            container_list = self.container_list.select_one(soup)
+            if container_list is None:
+                return None
+
+            outer_container = container_list
+
+        if not self.links:
+            return self.link_containers.select(outer_container, limit)
+
+        link_elements: list[Tag] = []
+
+        for container in self.link_containers.iselect(outer_container):
+            link_element = self.links.select_one(container)
+
+            if link_element is not None:
+                link_elements.append(link_element)
+
+                if len(link_elements) == limit:
+                    break
+
+        return link_elements
+
+
+@cache
+def compile_content_plan(container: str, remove: tuple[str, ...]) -> ContentPlan:
+    try:
+        container_selector: SoupSieve | None = compile_selector(container)
+    except Exception:
+        container_selector = None
+
+    return ContentPlan(
+        container_selector,
+        compile_selector(
+            ", ".join(default_remove_selectors + tuple(filter(None, remove)))
+        ),
+    )
+
+
+def content_plan(selectors: ArticleContent) -> ContentPlan:
+    return compile_content_plan(selectors.container, tuple(selectors.remove))
+
+
+def selector_key(selector: str | ElementSelector | None) -> SelectorKey:
+    # Empty selectors are skipped, as some profiles rely on LD+JSON for some fields and therefore doesn't have CSS selectors for author and date
+    if not selector:
+        return None
+
+    if isinstance(selector, ElementSelector):
+        return (selector.element, selector.content_field)
+
+    return selector
+
+
+def compile_meta_selector(key: SelectorKey) -> MetaSelector | None:
+    if key is None:
+        return None
+
+    if isinstance(key, tuple):
+        return MetaSelector(compile_selector(key[0]), key[1])
+
+    return MetaSelector(compile_selector(key), None)
+
+
+@cache
+def compile_meta_plan(*keys: SelectorKey) -> MetaPlan:
+    return MetaPlan(*(compile_meta_selector(key) for key in keys))
+
+
+def meta_plan(selectors: ArticleMeta) -> MetaPlan:
+    return compile_meta_plan(
+        *(selector_key(getattr(selectors, field)) for field in MetaPlan._fields)
+    )
+
+
+@cache
+def compile_link_plan(
+    container_list: str | None, link_containers: str, links: str | None
+) -> LinkPlan:
+    return LinkPlan(
+        compile_selector(container_list) if container_list else None,
+        compile_selector(link_containers),
+        compile_selector(links) if links else None,
+    )
+
+
+def link_plan(profile: Profile) -> LinkPlan:
+    targets = profile.source.scraping_targets
+    return compile_link_plan(
+        targets.container_list, targets.link_containers, targets.links
+    )
@@ -1,6 +1,7 @@
 from collections import Counter
+from functools import cache
 import re
-from typing import Callable, Iterator
+from typing import Callable, Iterable, Iterator
 import unicodedata
 import iocextract
 
@@ -23,27 +24,44 @@ def clean_text(clear_text: str) -> str:
     return clean_clear_text
 
 
-def tokenize_text(clean_clear_text: str) -> list[str]:
+contractions = re.compile(r"['’]\S*")
+# Equivalent to r'\s[,."\'/\\:-]+|[,."\'/\\:-]+\s', but starting with a single character class lets the regex engine
+# skip ahead to possible matches, which makes it a lot faster on long articles
+edge_punctuation = re.compile(
+    r'[\s,."\'/\\:-](?:(?<=\s)[,."\'/\\:-]+|(?<!\s)[,."\'/\\:-]*\s)'
+)
+brace_blocks = re.compile(r"\{.*\}")
+word_separators = str.maketrans('“"()', "    ")
+letterless_words = re.compile(r"\s[^a-zA-Z]*\s")
+
+
+def tokenize_text(clean_clear_text: str) -> Iterator[str]:
     # Removing all contractions and "'s" created in english by descriping possession
-    clean_clear_text = re.sub(r"(?:\'|’)\S*", "", clean_clear_text)
+    clean_clear_text = contractions.sub("", clean_clear_text)
     # Remove punctuation
-    clean_clear_text = re.sub(
-        r'\s(?:,|\.|"|\'|\/|\\|:|-)+|(?:,|\.|"|\'|\/|\\|:|-)+\s', " ", clean_clear_text
-    )
-    clean_clear_text = re.sub(r"(?:\{.*\})", "", clean_clear_text)
-    clean_clear_text = re.sub(r"“|\"|\(|\)", " ", clean_clear_text)
+    clean_clear_text = edge_punctuation.sub(" ", clean_clear_text)
+
+    if "{" in clean_clear_text:
+        clean_clear_text = brace_blocks.sub("", clean_clear_text)
+
+    clean_clear_text = clean_clear_text.translate(word_separators)
     # Remove all "words" where the word doesn't have any letters in it. This will remove "-", "3432" (words consisting purely of letters) and double spaces.
-    clean_clear_text = re.sub(r"\s[^a-zA-Z]*\s", " ", clean_clear_text)
+    clean_clear_text = letterless_words.sub(" ", clean_clear_text)
 
-    # Converting the cleaned cleartext to a list
-    clear_text_list = clean_clear_text.lower().split(" ")
+    # Converting the cleaned cleartext to words, skipping the empty strings left by repeated spaces
+    return filter(None, clean_clear_text.lower().split(" "))
 
-    return clear_text_list
 
+# Loaded once per process. Worker processes forked after the first call share the parent's copy
+@cache
+def get_common_words() -> frozenset[str]:
+    with open("./tools/wordlist.txt", "r") as f:
+        return frozenset(line.strip() for line in f)
 
-def generate_tags(clear_text_list: list[str]) -> list[str]:
+
+def generate_tags(clear_text_list: Iterable[str]) -> list[str]:
     """clear_text_list needs to be lowercase"""
-    common_words = set(line.strip() for line in open("./tools/wordlist.txt", "r"))
+    common_words = get_common_words()
 
     word_counts = Counter(clear_text_list)
 
@@ -59,15 +77,40 @@ def generate_tags(clear_text_list: list[str]) -> list[str]:
     return tags
 
 
-external_identifiers: dict[str, Callable[[str], Iterator[str]]] = {
-    "ipv4-adresses": lambda text: iocextract.extract_ipv4s(text, refang=True),
-    "ipv6-adresses": lambda text: iocextract.extract_ipv6s(text),
-    "email-adresses": lambda text: iocextract.extract_emails(text, refang=True),
-    "urls": lambda text: iocextract.extract_urls(text, refang=True),
-    "MD5-hash": lambda text: iocextract.extract_md5_hashes(text),
-    "SHA1-hash": lambda text: iocextract.extract_sha1_hashes(text),
-    "SHA256-hash": lambda text: iocextract.extract_sha256_hashes(text),
-    "SHA512-hash": lambda text: iocextract.extract_sha512_hashes(text),
+# Cheap patterns which are guaranteed to match somewhere in the text whenever the corresponding iocextract function finds
+# anything. Most articles doesn't contain any IOCs, so checking these first allows skipping the expensive extraction
+ioc_candidates: dict[str, re.Pattern[str]] = {
+    "ipv4": re.compile(r"\d(?:[\[\(\\]*\.[\]\)]*\d{1,3}){3}"),
+    "ipv6": re.compile(r":[a-f0-9]{0,4}:", re.IGNORECASE),
+    "email": re.compile(
+        r"(?:@|\Wat\W)[\)\]}\x20]*[a-z0-9-]+"
+        r"(?:(?:\x20*[\(\)\[\]{}<>\\]\x20*)*\.(?:\x20*[\(\)\[\]{}<>\\]\x20*)*|\W+dot\W+)[a-z0-9-]",
+        re.IGNORECASE,
+    ),
+    "url": re.compile(
+        # Schemes, hex and url-encoded "://" and defanged dots
+        r"(?i:[px]s?(?::(?://|\\\\)|\[:\]//|:?__)|3a2f2f|%3A%2F%2F)|[\(\[]\x20?\.\x20?[\]\)]|\\\x20?\."
+        # Base64 encoded "://"
+        r"|6\s*L\s*y|i\s*8\s*v|o\s*v\s*L"
+    ),
+    "hash": re.compile(r"[a-fA-F\d]{32}"),
+}
+
+external_identifiers: dict[str, tuple[str, Callable[[str], Iterator[str]]]] = {
+    "ipv4-adresses": (
+        "ipv4",
+        lambda text: iocextract.extract_ipv4s(text, refang=True),
+    ),
+    "ipv6-adresses": ("ipv6", lambda text: iocextract.extract_ipv6s(text)),
+    "email-adresses": (
+        "email",
+        lambda text: iocextract.extract_emails(text, refang=True),
+    ),
+    "urls": ("url", lambda text: iocextract.extract_urls(text, refang=True)),
+    "MD5-hash": ("hash", lambda text: iocextract.extract_md5_hashes(text)),
+    "SHA1-hash": ("hash", lambda text: iocextract.extract_sha1_hashes(text)),
+    "SHA256-hash": ("hash", lambda text: iocextract.extract_sha256_hashes(text)),
+    "SHA512-hash": ("hash", lambda text: iocextract.extract_sha512_hashes(text)),
 }
 
 internal_identifiers: dict[str, re.Pattern[str]] = {
@@ -93,8 +136,16 @@ def locate_objects_of_interest(clear_text: str) -> list[TagsOfInterest]:
             # Use list->set->list for duplicate removal
             results.append(TagsOfInterest(name=object_name, values=list(set(result))))
 
-    for object_name, identifier in external_identifiers.items():
-        # print(list(identifier(clear_text)), object_name, len(clear_text))
+    candidates = {
+        candidate_name
+        for candidate_name, pattern in ioc_candidates.items()
+        if pattern.search(clear_text)
+    }
+
+    for object_name, (candidate_name, identifier) in external_identifiers.items():
+        if candidate_name not in candidates:
+            continue
+
         result = list(set(identifier(clear_text)))
 
         if result:
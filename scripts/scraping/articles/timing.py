@@ -0,0 +1,170 @@
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import os
+import statistics
+import threading
+import time
+from typing import TypedDict
+
+from modules.misc import create_folder
+from rich.table import Table
+
+
+class Span(TypedDict):
+    stage: str
+    seconds: float
+    profile: str | None
+    url: str | None
+
+
+# Collects how long each stage of scraping takes, per article and per profile
+class TimingRecorder:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._spans: list[Span] = []
+
+    def record(self, spans: list[Span]) -> None:
+        with self._lock:
+            self._spans.extend(spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans = []
+
+    def spans(self) -> list[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def stage_durations(self) -> dict[str, list[float]]:
+        durations: defaultdict[str, list[float]] = defaultdict(list)
+
+        for span in self.spans():
+            durations[span["stage"]].append(span["seconds"])
+
+        return durations
+
+    def write_json_lines(self, path: str) -> None:
+        create_parent_folder(path)
+
+        with open(path, "w") as f:
+            for span in self.spans():
+                f.write(json.dumps(span))
+                f.write("\n")
+
+    # Summaries in the Prometheus text format, per stage and profile, for picking up with the node exporter's textfile collector
+    def write_prometheus(self, path: str) -> None:
+        totals: defaultdict[tuple[str, str], list[float]] = defaultdict(list)
+
+        for span in self.spans():
+            totals[(span["stage"], span["profile"] or "")].append(span["seconds"])
+
+        lines = [
+            "# HELP osinter_scrape_stage_seconds Time spent in each stage of scraping",
+            "# TYPE osinter_scrape_stage_seconds summary",
+        ]
+
+        for (stage, profile), seconds in sorted(totals.items()):
+            labels = f'stage="{stage}",profile="{profile}"'
+            lines.append(f"osinter_scrape_stage_seconds_sum{{{labels}}} {sum(seconds)}")
+            lines.append(
+                f"osinter_scrape_stage_seconds_count{{{labels}}} {len(seconds)}"
+            )
+
+        create_parent_folder(path)
+
+        # Written to a temporary file first, so the collector never reads a half written file
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        os.replace(temporary_path, path)
+
+    def summary_table(self) -> Table:
+        table = Table(
+            "Stage",
+            "Count",
+            "Total (s)",
+            "Mean (ms)",
+            "Median (ms)",
+            "P95 (ms)",
+            "Max (ms)",
+            title="Time spent per scraping stage",
+        )
+
+        for stage, seconds in sorted(
+            self.stage_durations().items(), key=lambda item: -sum(item[1])
+        ):
+            p95 = (
+                statistics.quantiles(seconds, n=20, method="inclusive")[-1]
+                if len(seconds) > 1
+                else seconds[0]
+            )
+            table.add_row(
+                stage,
+                str(len(seconds)),
+                f"{sum(seconds):.1f}",
+                f"{statistics.mean(seconds) * 1000:.1f}",
+                f"{statistics.median(seconds) * 1000:.1f}",
+                f"{p95 * 1000:.1f}",
+                f"{max(seconds) * 1000:.1f}",
+            )
+
+        return table
+
+
+def create_parent_folder(path: str) -> None:
+    folder = os.path.dirname(path)
+    if folder:
+        create_folder(folder, change_mode=False)
+
+
+recorder = TimingRecorder()
+
+# Spans are sent to the recorder, unless they are being collected for sending somewhere else, like back from a worker process
+_collected_spans: ContextVar[list[Span] | None] = ContextVar(
+    "collected_spans", default=None
+)
+
+
+def record_span(
+    stage: str, seconds: float, profile: str | None = None, url: str | None = None
+) -> None:
+    timed_span: Span = {
+        "stage": stage,
+        "seconds": seconds,
+        "profile": profile,
+        "url": url,
+    }
+
+    collected = _collected_spans.get()
+
+    if collected is None:
+        recorder.record([timed_span])
+    else:
+        collected.append(timed_span)
+
+
+@contextmanager
+def span(
+    stage: str, profile: str | None = None, url: str | None = None
+) -> Iterator[None]:
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start, profile, url)
+
+
+@contextmanager
+def collect_spans() -> Iterator[list[Span]]:
+    spans: list[Span] = []
+    token = _collected_spans.set(spans)
+
+    try:
+        yield spans
+    finally:
+        _collected_spans.reset(token)
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import time
+from functools import cache
+from typing import Any, NamedTuple
+
+from selenium import webdriver
+
+logger = logging.getLogger("osinter")
+
+
+class WaitSettings(NamedTuple):
+    # Longest time to wait for a page to be ready, before scraping whatever has rendered so far
+    timeout: float = 10.0
+    # How long no resources must have finished loading, for the network to be considered idle
+    network_idle: float = 0.5
+    # Once the content is there, how long to keep waiting for the network to go idle. Keeps pages which never stop
+    # loading things, like ads and analytics, from always running into the full timeout
+    settle_timeout: float = 2.0
+    # Longest time to wait for a JS injection to report that it's done
+    injection_timeout: float = 60.0
+    poll_interval: float = 0.1
+
+
+# Settings for individual profiles are read from a file next to the profiles, like:
+# {"profile_name": {"timeout": 20, "network_idle": 1.0}}
+wait_settings_path = "./profiles/wait_settings.json"
+
+
+@cache
+def load_wait_settings(path: str) -> dict[str, WaitSettings]:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "r") as f:
+        stored: dict[str, dict[str, float]] = json.load(f)
+
+    settings: dict[str, WaitSettings] = {}
+
+    for profile_name, options in stored.items():
+        unknown_options = set(options) - set(WaitSettings._fields)
+        if unknown_options:
+            logger.warning(
+                f'Ignoring unknown wait settings {", ".join(sorted(unknown_options))} for the "{profile_name}" profile'
+            )
+
+        settings[profile_name] = WaitSettings(
+            **{
+                option: float(value)
+                for option, value in options.items()
+                if option in WaitSettings._fields
+            }
+        )
+
+    return settings
+
+
+def get_wait_settings(profile_name: str | None) -> WaitSettings:
+    if profile_name is None:
+        return WaitSettings()
+
+    return load_wait_settings(wait_settings_path).get(profile_name, WaitSettings())
+
+
+# Gathers everything needed for deciding whether the page is ready in a single round trip to the browser. The network is
+# judged by when the last resource finished loading, as pages can't be asked directly about requests still in flight.
+# Without room for more entries the browser stops recording resources, which would make the network look idle.
+# Profile selectors are written for soupsieve, which supports selectors the browser doesn't, like :-soup-contains(), so
+# those can't be waited for and count as found
+page_state_script = """
+performance.setResourceTimingBufferSize(100000);
+
+const entries = performance.getEntriesByType("resource");
+const lastResponse = entries.reduce((last, entry) => Math.max(last, entry.responseEnd), 0);
+
+let contentFound = true;
+let selectorInvalid = false;
+
+if (arguments[0]) {
+    try {
+        contentFound = document.querySelector(arguments[0]) !== null;
+    } catch (e) {
+        selectorInvalid = true;
+    }
+}
+
+return {
+    readyState: document.readyState,
+    idleTime: (performance.now() - lastResponse) / 1000,
+    contentFound: contentFound,
+    selectorInvalid: selectorInvalid,
+};
+"""
+
+
+# Only warned about once per selector, as it would otherwise be logged on every poll of every page
+@cache
+def warn_invalid_selector(content_selector: str) -> None:
+    logger.warning(
+        f"The browser can't use the content selector \"{content_selector}\", so pages aren't waited on for it"
+    )
+
+
+def get_page_state(
+    driver: webdriver.Firefox, content_selector: str | None
+) -> dict[str, Any]:
+    state: dict[str, Any] = driver.execute_script(page_state_script, content_selector)
+
+    if content_selector and state.get("selectorInvalid"):
+        warn_invalid_selector(content_selector)
+
+    return state
+
+
+# Waits until the document has loaded, the content selector matches and the network has gone quiet, instead of
+# sleeping a fixed time for every page. Pages not getting there in time are scraped as they are
+def wait_for_page(
+    driver: webdriver.Firefox,
+    settings: WaitSettings,
+    content_selector: str | None = None,
+) -> bool:
+    start = time.monotonic()
+    deadline = start + settings.timeout
+    settle_deadline: float | None = None
+
+    while True:
+        state = get_page_state(driver, content_selector)
+        now = time.monotonic()
+
+        if state["readyState"] == "complete" and state["contentFound"]:
+            if state["idleTime"] >= settings.network_idle:
+                logger.debug(f"Page was ready after {now - start:.2f} seconds")
+                return True
+
+            if settle_deadline is None:
+                settle_deadline = now + settings.settle_timeout
+            elif now >= settle_deadline:
+                logger.debug(
+                    f"Content was found but the network didn't go idle after {now - start:.2f} seconds, continuing"
+                )
+                return True
+
+        if now >= deadline:
+            logger.debug(
+                f"Page wasn't ready after {settings.timeout} seconds, continuing with what has rendered "
+                f'(ready state "{state["readyState"]}", content found: {state["contentFound"]})'
+            )
+            return False
+
+        time.sleep(settings.poll_interval)
+
+
+def wait_for_injection(
+    driver: webdriver.Firefox, settings: WaitSettings, injection_name: str
+) -> bool:
+    deadline = time.monotonic() + settings.injection_timeout
+
+    while driver.execute_script("return document.osinterReady") == False:
+        if time.monotonic() >= deadline:
+            logger.warning(
+                f'JS injection "{injection_name}" didn\'t finish within {settings.injection_timeout} seconds, continuing'
+            )
+            return False
+
+        time.sleep(settings.poll_interval)
+
+    return True
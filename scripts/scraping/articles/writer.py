@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from types import TracebackType
+from typing import Any, Callable
+
+from elasticsearch import helpers
+from modules.objects import FullArticle
+
+from scripts import config_options
+
+from .timing import span
+
+logger = logging.getLogger("osinter")
+
+
+# Stores the article the same way as when saved on its own, with the ingest pipeline adding the ELSER tokens
+def article_action(article: FullArticle) -> dict[str, Any]:
+    action: dict[str, Any] = {
+        "_op_type": "index",
+        "_index": config_options.ELASTICSEARCH_ARTICLE_INDEX,
+        "_id": article.id,
+        "_source": article.model_dump(mode="json", exclude={"id"}),
+    }
+
+    if config_options.ELASTICSEARCH_ELSER_PIPELINE:
+        action["pipeline"] = config_options.ELASTICSEARCH_ELSER_PIPELINE
+
+    return action
+
+
+# Collects scraped articles and stores them with a single bulk request, instead of one request and ingest pipeline run per
+# article. The buffer is flushed once it's full, once the oldest article in it has waited long enough, and when closed
+class BulkArticleWriter:
+    def __init__(
+        self,
+        batch_size: int = 50,
+        flush_interval: float = 30.0,
+        on_saved: Callable[[FullArticle], None] | None = None,
+    ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_saved = on_saved
+
+        self.saved_count = 0
+        self.failed_count = 0
+
+        self._buffer: list[FullArticle] = []
+        self._buffer_started = 0.0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._closed = False
+
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def __enter__(self) -> "BulkArticleWriter":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def add(self, article: FullArticle) -> None:
+        with self._condition:
+            if not self._buffer:
+                self._buffer_started = time.monotonic()
+                self._condition.notify()
+
+            self._buffer.append(article)
+            full = len(self._buffer) >= self.batch_size
+
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._condition:
+            batch, self._buffer = self._buffer, []
+
+        if batch:
+            self._write(batch)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+        self._flusher.join()
+        self.flush()
+
+        logger.info(
+            f"Bulk writer stored {self.saved_count} articles, {self.failed_count} failed"
+        )
+
+    def _flush_periodically(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if not self._buffer:
+                        self._condition.wait()
+                        continue
+
+                    wait_time = (
+                        self._buffer_started + self.flush_interval - time.monotonic()
+                    )
+                    if wait_time <= 0:
+                        break
+
+                    self._condition.wait(wait_time)
+
+                if self._closed:
+                    return
+
+            self.flush()
+
+    # The bulk request reports the result for each article, so only the articles being rejected are saved again one at
+    # a time, without indexing the rest of the batch and running it through the ingest pipeline a second time
+    def _write(self, batch: list[FullArticle]) -> None:
+        with self._write_lock:
+            saved_articles: list[FullArticle] = []
+            rejected_articles: list[FullArticle] = []
+            # Rate limited articles are retried by the bulk helper, which reports them after the rest, so results are
+            # matched to articles by their id
+            unhandled = {article.id: article for article in batch}
+
+            try:
+                with span("save_documents"):
+                    for ok, item in helpers.streaming_bulk(
+                        config_options.es_conn,
+                        [article_action(article) for article in unhandled.values()],
+                        chunk_size=len(batch),
+                        max_retries=2,
+                        raise_on_error=False,
+                        raise_on_exception=False,
+                    ):
+                        result = item["index"]
+                        article = unhandled.pop(result["_id"])
+
+                        if ok:
+                            saved_articles.append(article)
+                        else:
+                            logger.warning(
+                                f'Bulk saving article with URL "{article.url}" failed, retrying it on its own: {result.get("error")}'
+                            )
+                            rejected_articles.append(article)
+            except Exception:
+                logger.exception(
+                    f"Bulk saving {len(batch)} articles failed, saving the remaining ones one at a time instead"
+                )
+
+            rejected_articles.extend(unhandled.values())
+
+            for article in rejected_articles:
+                try:
+                    with span("save_document", article.profile, str(article.url)):
+                        config_options.es_article_client.save_document(article)
+                    saved_articles.append(article)
+                except Exception:
+                    self.failed_count += 1
+                    logger.exception(
+                        f'Failed saving article with URL "{article.url}", skipping it'
+                    )
+
+            self.saved_count += len(saved_articles)
+
+            if self.on_saved:
+                for article in saved_articles:
+                    self.on_saved(article)
@@ -0,0 +1,60 @@
+from collections import defaultdict
+from typing import Any, cast
+from urllib.parse import urlparse
+
+import pytest
+from selenium import webdriver
+
+from scripts.scraping.articles.browser import BrowserConfig
+from scripts.scraping.articles.drivers import DriverPool
+
+
+# Stands in for Firefox, keeping site data for every domain in the same profile like a real browser does, with
+# cookies only being deleted for the site currently open
+class FakeFirefox:
+    def __init__(self, options: Any = None) -> None:
+        self.site_data: defaultdict[str, dict[str, str]] = defaultdict(dict)
+        self.current_domain = ""
+        self.quit_called = False
+
+    def get(self, url: str) -> None:
+        self.current_domain = urlparse(url).netloc
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        return True if script == "return true" else None
+
+    def delete_all_cookies(self) -> None:
+        self.site_data.pop(self.current_domain, None)
+
+    def quit(self) -> None:
+        self.quit_called = True
+
+
+@pytest.fixture
+def pool(monkeypatch: pytest.MonkeyPatch) -> DriverPool:
+    monkeypatch.setattr(webdriver, "Firefox", FakeFirefox)
+    return DriverPool(size=1, browser_config=BrowserConfig())
+
+
+def test_state_from_previous_domain_does_not_survive(pool: DriverPool) -> None:
+    with pool.driver("https://first.example/article") as driver:
+        first_driver = cast(FakeFirefox, driver)
+        first_driver.get("https://first.example/article")
+        first_driver.site_data["first.example"]["session"] = "first"
+        first_driver.site_data["tracker.example"]["id"] = "first"
+
+    with pool.driver("https://second.example/article") as driver:
+        second_driver = cast(FakeFirefox, driver)
+        second_driver.get("https://second.example/article")
+        assert second_driver is not first_driver
+        assert not second_driver.site_data
+
+    assert first_driver.quit_called
+
+
+def test_browser_is_reused_within_domain(pool: DriverPool) -> None:
+    with pool.driver("https://first.example/article") as first_driver:
+        pass
+
+    with pool.driver("https://first.example/other-article") as driver:
+        assert driver is first_driver